@@ -0,0 +1,3 @@
+#!/bin/sh
+
+dojo flask /opt/CTFd/CTFd/plugins/dojo_plugin/scripts/award_worker.py
@@ -23,7 +23,6 @@ from ...models import DojoModules, DojoChallenges
 from ...utils import (
     container_name,
     lookup_workspace_token,
-    resolved_tar,
     serialize_user_flag,
     user_docker_client,
     user_node,
@@ -31,9 +30,17 @@ from ...utils import (
     get_current_container,
     is_challenge_locked,
 )
+from ...utils.active_workspace import clear_active_workspace, set_active_workspace
 from ...utils.dojo import dojo_accessible, get_current_dojo_challenge
 from ...utils.workspace import exec_run
 from ...utils.feed import publish_container_start
+from ...utils.tar_cache import challenge_tars
+from ...utils.image_cache import image_config
+from ...utils.placement import place_workspace
+from ...utils.redis_client import get_redis_client
+from ...utils.workspaces import add_workspace, remove_workspace
+from ...utils.fanout import fan_out
+from ...utils.mac_docker import MacDockerClient
 from ...utils.request_logging import get_trace_id, log_generator_output
 
 logger = logging.getLogger(__name__)
@@ -48,23 +55,38 @@ HOST_HOMES_OVERLAYS = HOST_HOMES / "overlays"
 
 
 def remove_container(user):
-    # Just in case our container is still running on the other docker container, let's make sure we try to kill both
-    known_image_name = cache.get(f"user_{user.id}-running-image")
-    images = [None, known_image_name]
-    for image_name in images:
-        docker_client = user_docker_client(user, image_name)
+    # Just in case our container is still running on the other docker container, let's make sure we try to kill both;
+    # the removals run in worker threads, so everything they need is read from the request's user up front
+    user_id = user.id
+    name = container_name(user)
+    node_id = user_node(user)
+    known_image_name = cache.get(f"user_{user_id}-running-image")
+    docker_clients = {"node": user_docker_client(user)}
+    if known_image_name and known_image_name.startswith("mac:"):
+        docker_clients["mac"] = user_docker_client(user, known_image_name)
+
+    def remove(docker_client):
         try:
-            container = docker_client.containers.get(container_name(user))
+            container = docker_client.containers.get(name)
             container.remove(force=True)
             container.wait(condition="removed")
+            if not isinstance(docker_client, MacDockerClient):
+                remove_workspace(container, node_id)
         except (docker.errors.NotFound, docker.errors.APIError):
             pass
-        for volume in [f"{user.id}", f"{user.id}-overlay"]:
+        for volume in [f"{user_id}", f"{user_id}-overlay"]:
             try:
                 docker_client.volumes.get(volume).remove()
             except (docker.errors.NotFound, docker.errors.APIError):
                 pass
 
+    _, failures = fan_out(remove, docker_clients)
+    # The user's own node must be clear before a new workspace starts there; anywhere else is best-effort (and
+    # fan_out has already logged the failure)
+    if "node" in failures:
+        raise failures["node"]
+    clear_active_workspace(user)
+
 def get_available_devices(docker_client):
     key = f"devices-{docker_client.api.base_url}"
     if (cached := cache.get(key)) is not None:
@@ -101,8 +123,8 @@ def start_container(docker_client, user, as_user, user_mounts, dojo_challenge, p
 
     challenge_bin_path = "/run/challenge/bin"
     dojo_bin_path = "/run/dojo/bin"
-    image = docker_client.images.get(resolved_dojo_challenge.image)
-    image_env = image.attrs["Config"].get("Env") or []
+    node_id = None if isinstance(docker_client, MacDockerClient) else user_node(user)
+    image_env = image_config(docker_client, resolved_dojo_challenge.image, node_id=node_id).get("Env") or []
     image_path = next((env_var[len("PATH="):].split(":") for env_var in image_env if env_var.startswith("PATH=")), [])
     env_path = ":".join([challenge_bin_path, dojo_bin_path, *image_path])
 
@@ -216,37 +238,28 @@ def start_container(docker_client, user, as_user, user_mounts, dojo_challenge, p
 
 
 def insert_challenge(container, as_user, dojo_challenge):
-    def is_option_path(path):
-        path = pathlib.Path(*path.parts[: len(dojo_challenge.path.parts) + 1])
-        return path.name.startswith("_") and path.is_dir()
-
     exec_run("/run/dojo/bin/mkdir -p /challenge", container=container)
 
-    root_dir = dojo_challenge.path.parent.parent
-    challenge_tar = resolved_tar(
-        dojo_challenge.path,
-        root_dir=root_dir,
-        filter=lambda path: not is_option_path(path),
-    )
-    container.put_archive("/challenge", challenge_tar)
-
-    option_paths = sorted(
-        path for path in dojo_challenge.path.iterdir() if is_option_path(path)
-    )
-    if option_paths:
-        secret = current_app.config["SECRET_KEY"]
-        option_hash = hashlib.sha256(
-            f"{secret}_{as_user.id}_{dojo_challenge.challenge_id}".encode()
-        ).digest()
-        option = option_paths[
-            int.from_bytes(option_hash[:8], "little") % len(option_paths)
-        ]
-        container.put_archive("/challenge", resolved_tar(option, root_dir=root_dir))
-
-    exec_run(
-        r"/run/dojo/bin/find /challenge/ -mindepth 1 -exec /run/dojo/bin/chown root:root {} \;", container=container
-    )
-    exec_run(r"/run/dojo/bin/find /challenge/ -mindepth 1 -exec /run/dojo/bin/chmod 4755 {} \;", container=container)
+    with challenge_tars(dojo_challenge.path, root_dir=dojo_challenge.path.parent.parent) as (challenge_tar, *option_tars):
+        container.put_archive("/challenge", challenge_tar)
+
+        if option_tars:
+            secret = current_app.config["SECRET_KEY"]
+            option_hash = hashlib.sha256(
+                f"{secret}_{as_user.id}_{dojo_challenge.challenge_id}".encode()
+            ).digest()
+            option_tar = option_tars[
+                int.from_bytes(option_hash[:8], "little") % len(option_tars)
+            ]
+            container.put_archive("/challenge", option_tar)
+
+    if dojo_challenge.fixup_permissions:
+        exec_run(
+            "/run/dojo/bin/find /challenge/ -mindepth 1 "
+            "-exec /run/dojo/bin/chown root:root {} + "
+            "-exec /run/dojo/bin/chmod 4755 {} +",
+            container=container,
+        )
 
 
 def insert_flag(container, flag):
@@ -262,6 +275,10 @@ def insert_flag(container, flag):
 
 
 def start_challenge(user, dojo_challenge, practice, *, as_user=None):
+    # Remove the old workspace from wherever it was placed before choosing a node for the new one
+    remove_container(user)
+    place_workspace(user, dojo_challenge.image)
+
     docker_client = user_docker_client(user, image_name=dojo_challenge.image)
     node_id = user_node(user)
     if node_id is None:
@@ -269,7 +286,6 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None):
     logger.info(f"starting challenge dojo={
         dojo_challenge.dojo.reference_id
     } module={dojo_challenge.module.id} challenge={dojo_challenge.id} {practice=} {as_user=} node_id={node_id+1}")
-    remove_container(user)
 
     user_mounts = []
     if as_user is None:
@@ -312,8 +328,14 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None):
         practice=practice,
     )
 
+    if not isinstance(docker_client, MacDockerClient):
+        add_workspace(container, user_node(user))
+    set_active_workspace(user, dojo_challenge, container, practice=practice, as_user=as_user)
+    container_time = time.time()
+
     if dojo_challenge.path.exists():
         insert_challenge(container, as_user, dojo_challenge)
+    insert_time = time.time()
 
     if practice:
         flag = "practice"
@@ -322,12 +344,18 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None):
     else:
         flag = serialize_user_flag(as_user.id, dojo_challenge.challenge_id)
     insert_flag(container, flag)
+    flag_time = time.time()
 
     for message in log_generator_output(
         "workspace readying ", container.logs(stream=True, follow=True), start_time=start_time
     ):
         if b"DOJO_INIT_READY" in message or message == b"Ready.\n":
-            logger.info(f"workspace ready after {time.time()-start_time:.1f} seconds")
+            ready_time = time.time()
+            logger.info(
+                f"workspace ready after {ready_time-start_time:.1f} seconds "
+                f"(container={container_time-start_time:.1f}s insert={insert_time-container_time:.1f}s "
+                f"flag={flag_time-insert_time:.1f}s ready={ready_time-flag_time:.1f}s)"
+            )
             break
         if b"DOJO_INIT_FAILED:" in message:
             cause = message.split(b"DOJO_INIT_FAILED:")[1].split(b"\n")[0]
@@ -338,7 +366,7 @@ def start_challenge(user, dojo_challenge, practice, *, as_user=None):
 def docker_locked(func):
     def wrapper(*args, **kwargs):
         user = get_current_user()
-        redis_client = redis.from_url(current_app.config["REDIS_URL"])
+        redis_client = get_redis_client()
         try:
             with redis_client.lock(f"user.{user.id}.docker.lock",
                                    blocking_timeout=0,
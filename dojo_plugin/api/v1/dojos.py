@@ -13,6 +13,7 @@ from sqlalchemy.sql import and_
 from ...models import (DojoChallenges, DojoModules, Dojos, DojoStudents,
                        DojoUsers, Emojis, SurveyResponses)
 from ...utils import is_challenge_locked, render_markdown
+from ...utils.completion import invalidate_completions
 from ...utils.dojo import dojo_admins_only, dojo_create, dojo_route
 from ...utils.stats import get_dojo_stats
 
@@ -50,6 +51,7 @@ class PruneAwards(Resource):
     @dojo_route
     @dojo_admins_only
     def post(self, dojo):
+        invalidate_completions(dojo.dojo_id)
         all_completions = set(user for user,_ in dojo.completions())
         num_pruned = 0
         for award in Emojis.query.where(Emojis.category==dojo.hex_dojo_id, Emojis.name != "STALE"):
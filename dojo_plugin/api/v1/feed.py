@@ -1,53 +1,42 @@
-import json
-import time
-import redis
-from flask import Response, request, current_app
+import math
+
+from flask import Response, request
 from flask_restx import Namespace, Resource
 from ...utils.feed import get_recent_events
+from ...utils.feed_hub import feed_hub
 
 feed_namespace = Namespace("feed", description="Activity feed endpoints")
 
 
+def feed_filters():
+    user_id = request.args.get("user")
+    return request.args.get("dojo") or None, int(user_id) if user_id and user_id.isdigit() else None
+
+
 @feed_namespace.route("/events")
 class FeedEvents(Resource):
     def get(self):
         try:
             limit = min(int(request.args.get("limit", 50)), 100)
-            offset = max(int(request.args.get("offset", 0)), 0)
-        except (ValueError, TypeError):
-            limit, offset = 50, 0
-        events = get_recent_events(limit=limit, offset=offset)
-        return {"success": True, "data": events, "meta": {"limit": limit, "offset": offset, "count": len(events)}}
+        except ValueError:
+            limit = 50
+        before = request.args.get("before") or None
+        if before is not None:
+            try:
+                valid = math.isfinite(float(before))
+            except ValueError:
+                valid = False
+            if not valid:
+                return {"success": False, "error": "Invalid cursor"}, 400
+        dojo, user_id = feed_filters()
+        events, next_cursor = get_recent_events(limit=limit, before=before, dojo=dojo, user_id=user_id)
+        return {"success": True, "data": events, "meta": {"limit": limit, "count": len(events), "next_cursor": next_cursor}}
 
 
 @feed_namespace.route("/stream")
 class FeedStream(Resource):
     def get(self):
-        redis_url = current_app.config.get("REDIS_URL", "redis://cache:6379")
-        
-        def generate():
-            r = redis.from_url(redis_url, decode_responses=True)
-            pubsub = r.pubsub()
-            pubsub.subscribe("activity_feed:live")
-            yield f"data: {json.dumps({'type': 'connected'})}\n\n"
-            last_heartbeat = time.time()
-            
-            try:
-                while True:
-                    message = pubsub.get_message(timeout=1)
-                    if message and message['type'] == 'message':
-                        try:
-                            yield f"data: {message['data']}\n\n"
-                        except (TypeError, ValueError):
-                            continue
-                    if time.time() - last_heartbeat > 30:
-                        yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-                        last_heartbeat = time.time()
-            except GeneratorExit:
-                pubsub.close()
-                raise
-            except Exception:
-                pubsub.close()
-                
-        return Response(generate(), mimetype="text/event-stream",
-            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Connection": "keep-alive"})
\ No newline at end of file
+        last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        dojo, user_id = feed_filters()
+        return Response(feed_hub().stream(last_event_id, dojo, user_id), mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Connection": "keep-alive"})
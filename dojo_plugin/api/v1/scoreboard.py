@@ -1,122 +1,56 @@
-import collections
-import contextlib
-import datetime
-import math
-import pytz
-import json
-
-import redis
-
-from flask import url_for, abort, current_app
+from flask import url_for
 from flask_restx import Namespace, Resource
 from flask_sqlalchemy import Pagination
-from CTFd.cache import cache
-from CTFd.models import db, Solves, Challenges, Users, Submissions, Awards
+from CTFd.models import Users
 from CTFd.utils.user import get_current_user
-from CTFd.utils.modes import get_model, generate_account_url
-from sqlalchemy import event
-from sqlalchemy.orm.session import Session
 
-from ...models import Dojos, DojoChallenges, DojoUsers, DojoMembers, DojoAdmins, DojoStudents, DojoModules, DojoChallengeVisibilities, Belts, Emojis
-from ...utils.dojo import dojo_route, dojo_accessible
+from ...utils.dojo import dojo_route
 from ...utils.awards import get_belts, get_viewable_emojis
+from ...utils.scoreboard import get_scoreboard
 
-SCOREBOARD_CACHE_TIMEOUT_SECONDS = 60 * 60 * 2 # two hours make to cache all scoreboards
 scoreboard_namespace = Namespace("scoreboard")
 
 def email_symbol_asset(email):
     if email.endswith("@asu.edu"):
         group = "fork.png"
-    elif ".edu" in email.split("@")[1]:
+    elif ".edu" in email.partition("@")[2]:
         group = "student.png"
     else:
         group = "hacker.png"
     return url_for("views.themes", path=f"img/dojo/{group}")
 
-@cache.memoize(timeout=SCOREBOARD_CACHE_TIMEOUT_SECONDS)
-def get_scoreboard_for(model, duration):
-    duration_filter = (
-        Solves.date >= datetime.datetime.utcnow() - datetime.timedelta(days=duration)
-        if duration else True
-    )
-    required_filter = DojoChallenges.required == True
-    solves = db.func.count().label("solves")
-    rank = (
-        db.func.row_number()
-        .over(order_by=(solves.desc(), db.func.max(Solves.id)))
-        .label("rank")
-    )
-    user_entities = [Solves.user_id, Users.name, Users.email]
-    query = (
-        model.solves()
-        .filter(duration_filter)
-        .filter(required_filter)
-        .group_by(*user_entities)
-        .order_by(rank)
-        .with_entities(rank, solves, *user_entities)
-    )
-
-    row_results = query.all()
-    results = [{key: getattr(item, key) for key in item.keys()} for item in row_results]
-    return results
-
-def invalidate_scoreboard_cache():
-    cache.delete_memoized(get_scoreboard_for)
-
-# handle cache invalidation for new solves, dojo creation, dojo challenge creation
-@event.listens_for(Dojos, 'after_insert', propagate=True)
-@event.listens_for(Dojos, 'after_delete', propagate=True)
-@event.listens_for(Solves, 'after_insert', propagate=True)
-@event.listens_for(Solves, 'after_delete', propagate=True)
-@event.listens_for(Awards, 'after_insert', propagate=True)
-@event.listens_for(Awards, 'after_delete', propagate=True)
-@event.listens_for(Belts, 'after_insert', propagate=True)
-@event.listens_for(Belts, 'after_delete', propagate=True)
-@event.listens_for(Emojis, 'after_insert', propagate=True)
-@event.listens_for(Emojis, 'after_delete', propagate=True)
-def hook_object_creation(mapper, connection, target):
-    invalidate_scoreboard_cache()
-
-@event.listens_for(Users, 'after_update', propagate=True)
-@event.listens_for(Dojos, 'after_update', propagate=True)
-@event.listens_for(DojoUsers, 'after_update', propagate=True)
-@event.listens_for(DojoMembers, 'after_update', propagate=True)
-@event.listens_for(DojoAdmins, 'after_update', propagate=True)
-@event.listens_for(DojoStudents, 'after_update', propagate=True)
-@event.listens_for(DojoModules, 'after_update', propagate=True)
-@event.listens_for(DojoChallenges, 'after_update', propagate=True)
-@event.listens_for(DojoChallengeVisibilities, 'after_update', propagate=True)
-@event.listens_for(Belts, 'after_update', propagate=True)
-@event.listens_for(Emojis, 'after_update', propagate=True)
-def hook_object_update(mapper, connection, target):
-    # according to the docs, this is a necessary check to see if the
-    # target actually was modified (and thus an update was made)
-    if Session.object_session(target).is_modified(target, include_collections=False):
-        invalidate_scoreboard_cache()
-
 def get_scoreboard_page(model, duration=None, page=1, per_page=20):
     belt_data = get_belts()
-    results = get_scoreboard_for(model, duration)
-
+    user = get_current_user()
     start_idx = (page - 1) * per_page
     end_idx = start_idx + per_page
-    pagination = Pagination(None, page, per_page, len(results), results[start_idx:end_idx])
-    user = get_current_user()
+    total, standings, me = get_scoreboard(model, duration, start_idx, end_idx, user=user if user and not user.hidden else None)
+
+    user_ids = [user_id for _, user_id, _ in standings] + ([me[1]] if me else [])
+    users = {
+        user_id: (name, email)
+        for user_id, name, email in Users.query.filter(Users.id.in_(user_ids)).with_entities(Users.id, Users.name, Users.email)
+    } if user_ids else {}
+
+    pagination = Pagination(None, page, per_page, total, standings)
     emojis = get_viewable_emojis(user)
 
     def standing(item):
         if not item:
             return
-        user_id = item["user_id"]
+        rank, user_id, solves = item
+        name, email = users.get(user_id, (None, ""))
         belt_color = belt_data["users"].get(user_id, {"color": "white"})["color"]
-        result = {key: item[key] for key in item.keys()}
-        result.update({
+        return {
+            "rank": rank,
+            "solves": solves,
+            "user_id": user_id,
+            "name": name,
             "url": url_for("pwncollege_users.view_other", user_id=user_id),
-            "symbol": email_symbol_asset(result.pop("email")),
+            "symbol": email_symbol_asset(email),
             "belt": url_for("pwncollege_belts.view_belt", color=belt_color),
             "badges": emojis.get(user_id, [])
-        })
-        return result
+        }
 
     result = {
         "standings": [standing(item) for item in pagination.items],
@@ -124,15 +58,10 @@ def get_scoreboard_page(model, duration=None, page=1, per_page=20):
 
     pages = set(page for page in pagination.iter_pages() if page)
 
-    if user and not user.hidden:
-        me = None
-        for r in results:
-            if r["user_id"] == user.id:
-                me = standing(r)
-                break
-        if me:
-            pages.add((me["rank"] - 1) // per_page + 1)
-            result["me"] = me
+    if me:
+        me = standing(me)
+        pages.add((me["rank"] - 1) // per_page + 1)
+        result["me"] = me
 
     result["pages"] = sorted(pages)
 
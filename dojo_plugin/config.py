@@ -17,6 +17,20 @@ DOJOS_DIR = pathlib.Path("/var/dojos")
 FEED_EVENT_TTL = int(os.environ.get("FEED_EVENT_TTL", "86400"))
 FEED_MAX_EVENTS = int(os.environ.get("FEED_MAX_EVENTS", "1000"))
 FEED_BATCH_SIZE = int(os.environ.get("FEED_BATCH_SIZE", "50"))
+FEED_CLIENT_QUEUE_SIZE = int(os.environ.get("FEED_CLIENT_QUEUE_SIZE", "64"))
+
+# "redis" hands award evaluation to the award worker, "local" evaluates awards inline
+AWARDS_QUEUE = os.environ.get("AWARDS_QUEUE", "redis" if os.environ.get("DOJO_ENV") == "production" else "local")
+
+# Per-node deadline for operations fanned out across every workspace node
+NODE_FANOUT_TIMEOUT = int(os.environ.get("NODE_FANOUT_TIMEOUT", "30"))
+
+# Sources the workspace placement scheduler consults for node load and home volume locality
+PROMETHEUS_URL = os.environ.get("PROMETHEUS_URL", "http://prometheus:9090")
+HOMEFS_URL = os.environ.get("HOMEFS_URL", "http://192.168.42.1:4201")
+PLACEMENT_TIMEOUT = float(os.environ.get("PLACEMENT_TIMEOUT", "2"))
+# Moving a home volume off its node waits for the node's final snapshot to reach storage
+MIGRATION_TIMEOUT = float(os.environ.get("MIGRATION_TIMEOUT", "60"))
 
 WORKSPACE_NODES = {
     int(node_id): node_key
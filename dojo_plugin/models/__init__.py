@@ -281,7 +281,8 @@ class Dojos(db.Model):
         return awards
 
     def completed(self, user):
-        return self.solves(user=user, ignore_visibility=True, ignore_admins=False).count() == len([challenge for challenge in self.challenges if challenge.required])
+        from ..utils.completion import dojo_completed
+        return dojo_completed(self, user)
 
     def is_admin(self, user=None):
         if user is None:
@@ -530,9 +531,10 @@ class DojoChallenges(db.Model):
     required = db.Column(db.Boolean, default=True, nullable=False)
 
     data = db.Column(JSONB)
-    data_fields = ["image", "privileged", "path_override", "importable", "allow_privileged", "progression_locked", "survey", "unified_index", "interfaces"]
+    data_fields = ["image", "privileged", "path_override", "importable", "allow_privileged", "progression_locked", "survey", "unified_index", "interfaces", "fixup_permissions"]
     data_defaults = {
         "privileged": False,
+        "fixup_permissions": False,
         "importable": True,
         "allow_privileged": True,
         "progression_locked": False,
@@ -695,6 +697,43 @@ class DojoChallenges(db.Model):
     __repr__ = columns_repr(["module", "id", "challenge_id"])
 
 
+class DojoScores(db.Model):
+    __tablename__ = "dojo_scores"
+
+    dojo_id = db.Column(db.Integer, db.ForeignKey("dojos.dojo_id", ondelete="CASCADE"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
+    solves = db.Column(db.Integer, default=0, nullable=False)
+    last_solve_date = db.Column(db.DateTime)
+    rank = db.Column(db.Integer)
+
+    __repr__ = columns_repr(["dojo_id", "user_id", "solves", "rank"])
+
+
+class DojoModuleScores(db.Model):
+    __tablename__ = "dojo_module_scores"
+
+    # Not a foreign key to dojo_modules: modules are recreated on every dojo update
+    dojo_id = db.Column(db.Integer, db.ForeignKey("dojos.dojo_id", ondelete="CASCADE"), primary_key=True)
+    module_index = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
+    solves = db.Column(db.Integer, default=0, nullable=False)
+    last_solve_date = db.Column(db.DateTime)
+    rank = db.Column(db.Integer)
+
+    __repr__ = columns_repr(["dojo_id", "module_index", "user_id", "solves", "rank"])
+
+
+class DojoDailyStats(db.Model):
+    __tablename__ = "dojo_daily_stats"
+
+    dojo_id = db.Column(db.Integer, db.ForeignKey("dojos.dojo_id", ondelete="CASCADE"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    solves = db.Column(db.Integer, default=0, nullable=False)
+    users = db.Column(db.Integer, default=0, nullable=False)
+
+    __repr__ = columns_repr(["dojo_id", "day", "solves", "users"])
+
+
 class SurveyResponses(db.Model):
     __tablename__ = "survey_responses"
 
@@ -912,6 +951,16 @@ class Emojis(Awards):
     __mapper_args__ = {"polymorphic_identity": "emoji"}
 
 
+class WorkspacePlacements(db.Model):
+    __tablename__ = "workspace_placements"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    node_id = db.Column(db.Integer, nullable=False)
+    placed = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    __repr__ = columns_repr(["user_id", "node_id"])
+
+
 class WorkspaceTokens(db.Model):
     __tablename__ = "workspace_tokens"
     id = db.Column(db.Integer, primary_key=True)
@@ -11,7 +11,7 @@ from CTFd.utils.decorators import authed_only
 from ..models import DiscordUsers
 from ..config import DISCORD_CLIENT_ID
 from ..utils.discord import OAUTH_ENDPOINT, get_discord_id, get_discord_member, add_role
-from ..utils.awards import update_awards
+from ..utils.awards import queue_awards
 
 
 discord = Blueprint("discord", __name__)
@@ -67,7 +67,7 @@ def discord_redirect():
         db.session.commit()
         if get_discord_member(discord_id):
             add_role(discord_id, "White Belt")
-            update_awards(user)
+            queue_awards(user)
     except IntegrityError:
         db.session.rollback()
         return {"success": False, "error": "Discord user already in use"}, 400
@@ -15,8 +15,9 @@ from CTFd.utils.decorators import authed_only
 from CTFd.utils.user import get_current_user, is_admin
 from CTFd.utils.helpers import get_infos
 
-from ..utils import get_current_container, get_all_containers, render_markdown
-from ..utils.stats import get_container_stats, get_dojo_stats
+from ..utils import get_current_container, render_markdown
+from ..utils.stats import get_dojo_stats
+from ..utils.workspaces import get_workspace_counts, get_workspaces
 from ..utils.dojo import dojo_route, get_current_dojo_challenge, dojo_update, dojo_admins_only
 from ..utils.query_timer import query_timeout
 from ..models import Dojos, DojoUsers, DojoStudents, DojoModules, DojoMembers, DojoChallenges
@@ -80,11 +81,10 @@ def listing(dojo):
     dojo_user = DojoUsers.query.filter_by(dojo=dojo, user=user).first()
     stats = get_dojo_stats(dojo)
     awards = dojo.awards()
-    module_container_counts = collections.Counter(
-        container["module"]
-        for container in get_container_stats()
-        if container["dojo"] == dojo.reference_id
-    )
+    module_container_counts = collections.Counter()
+    for (dojo_id, module_id, _), count in get_workspace_counts().items():
+        if dojo_id == dojo.reference_id:
+            module_container_counts[module_id] += count
     stats["active"] = sum(module_container_counts.values())
 
     description_edit_url = None
@@ -273,20 +273,15 @@ def view_dojo_admin(dojo):
 @dojo_route
 @dojo_admins_only
 def view_dojo_activity(dojo):
-    containers = get_all_containers(dojo)
+    workspaces = get_workspaces(dojo)
 
     actives = []
     now = datetime.datetime.now()
-    for container in containers:
-        user_id = container.labels["dojo.user_id"]
-        dojo_id = container.labels["dojo.dojo_id"]
-        module_id = container.labels["dojo.module_id"]
-        challenge_id = container.labels["dojo.challenge_id"]
-
-        user = Users.query.filter_by(id=user_id).first()
-        challenge = DojoChallenges.from_id(dojo_id, module_id, challenge_id).first()
+    for workspace in workspaces:
+        user = Users.query.filter_by(id=workspace["user_id"]).first()
+        challenge = DojoChallenges.from_id(workspace["dojo"], workspace["module"], workspace["challenge"]).first()
 
-        created = datetime.datetime.fromisoformat(container.attrs["Created"].split(".")[0])
+        created = datetime.datetime.fromisoformat(workspace["created"].split(".")[0])
         uptime = now - created
 
         actives.append(dict(user=user, challenge=challenge, uptime=uptime))
@@ -372,11 +367,11 @@ def view_module(dojo, module, scroll_to_challenge=None):
                 until=until,
             ))
 
-    challenge_container_counts = collections.Counter(
-        container["challenge"]
-        for container in get_container_stats()
-        if container["module"] == module.id and container["dojo"] == dojo.reference_id
-    )
+    challenge_container_counts = collections.Counter({
+        challenge_id: count
+        for (dojo_id, module_id, challenge_id), count in get_workspace_counts().items()
+        if module_id == module.id and dojo_id == dojo.reference_id
+    })
 
     module_description_edit_url = None
     challenge_description_edit_urls = {}
@@ -7,7 +7,7 @@ from CTFd.utils.decorators import authed_only, admins_only
 
 from ..models import DojoChallenges, Dojos, DojoAdmins, DojoMembers
 from ..utils.dojo import generate_ssh_keypair
-from ..utils.stats import get_container_stats
+from ..utils.workspaces import get_workspace_counts
 
 
 dojos = Blueprint("pwncollege_dojos", __name__)
@@ -80,7 +80,9 @@ def listing(template="dojos.html"):
             elif all(solves >= dojo.required_challenges_count for dojo, solves in curriculum):
                 categorized_dojos["next"] = categorized_dojos["public"][:]
 
-    dojo_container_counts = collections.Counter(stats["dojo"] for stats in get_container_stats())
+    dojo_container_counts = collections.Counter()
+    for (dojo_id, _, _), count in get_workspace_counts().items():
+        dojo_container_counts[dojo_id] += count
 
     return render_template(template, user=user, categorized_dojos=categorized_dojos, dojo_container_counts=dojo_container_counts)
 
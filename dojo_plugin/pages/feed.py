@@ -9,7 +9,7 @@ feed = Blueprint("pwncollege_feed", __name__)
 @feed.route("/feed")
 @check_account_visibility
 def feed_page():
-    initial_events = get_recent_events(limit=20)
+    initial_events, _ = get_recent_events(limit=20)
     
     return render_template(
         "feed.html",
@@ -42,7 +42,7 @@ def view_hacker(user, bypass_hidden=False):
     return render_template(
         "hacker.html",
         dojos=dojos, user=user,
-        dojo_scores=dojo_scores(), module_scores=module_scores(),
+        dojo_scores=dojo_scores(user), module_scores=module_scores(user),
         belts=get_belts(), badges=get_viewable_emojis(get_current_user()),
         user_solves=user_solves
     )
@@ -0,0 +1,23 @@
+import logging
+
+from ..utils.awards import recover_award_queue, process_award_queue
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+recovered = recover_award_queue()
+logger.info(f"Award worker started ({recovered} interrupted users requeued).")
+
+while True:
+    try:
+        user_id = process_award_queue()
+    except Exception as e:
+        logger.error("Award evaluation failed", exc_info=e)
+        db.session.rollback()
+        continue
+    finally:
+        db.session.remove()
+    if user_id is not None:
+        logger.info(f"Awards evaluated for user {user_id}.")
@@ -2,7 +2,8 @@ import logging
 
 import docker
 
-from ..utils import all_docker_clients
+from ..utils.fanout import fan_out_nodes
+from ..utils.image_cache import image_config_cache_stats, refresh_image_config
 from ..config import DOCKER_USERNAME, DOCKER_TOKEN
 
 
@@ -10,17 +11,31 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-for image, in DojoChallenges.query.with_entities(db.distinct(DojoChallenges.data["image"])).all():
-    if not image or image.startswith("mac:") or image.startswith("pwncollege-"):
-        continue
+PULL_TIMEOUT = 3600
 
-    for client in all_docker_clients():
-        if DOCKER_USERNAME and DOCKER_TOKEN:
-            client.login(DOCKER_USERNAME, DOCKER_TOKEN)
+images = [
+    image for image, in DojoChallenges.query.with_entities(db.distinct(DojoChallenges.data["image"])).all()
+    if image and not image.startswith("mac:") and not image.startswith("pwncollege-")
+]
+
+
+def pull_images(node_id, client):
+    # Each node pulls its images in order, while all nodes pull at once
+    if DOCKER_USERNAME and DOCKER_TOKEN:
+        client.login(DOCKER_USERNAME, DOCKER_TOKEN)
+    for image in images:
         logger.info(f"Pulling image {image} on {client.api.base_url}...")
         try:
-            client.images.pull(image)
+            refresh_image_config(client, client.images.pull(image), image, node_id=node_id)
         except docker.errors.ImageNotFound:
             logger.error(f"... image not found: {image} on {client.api.base_url}...")
         except Exception as e:
             logger.error(f"... error: {image} on {client.api.base_url}...", exc_info=e)
+
+
+_, failures = fan_out_nodes(pull_images, timeout=PULL_TIMEOUT)
+for node_id, error in failures.items():
+    logger.error(f"pull_images failed on node {node_id}: {error!r}")
+
+for image, stats in image_config_cache_stats().items():
+    logger.info(f"Image config cache {image}: {stats['hit']} hits, {stats['miss']} misses ({stats['hit_rate']:.0%})")
@@ -7,14 +7,31 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 from ..utils import scores
-scores.dojo_scores()
-logger.info("Dojo scores cache warmed.")
-scores.module_scores()
-logger.info("Module scores cache warmed.")
+refreshed = scores.refresh_stale_scores()
+logger.info(f"Dojo scores refreshed ({'all dojos' if refreshed is None else f'{len(refreshed)} stale dojos'}).")
+if refreshed is None:
+	scores.refresh_ranks()
+	ranked = "all dojos"
+else:
+	ranked = f"{len(scores.refresh_stale_ranks(refreshed))} stale dojos"
+scores.score_totals()
+logger.info(f"Dojo score ranks refreshed ({ranked}).")
+
+from ..utils import active_workspace
+workspaces = active_workspace.reconcile_active_workspaces()
+logger.info(f"Active workspaces reconciled ({workspaces} running).")
+
+from ..utils import scoreboard
+boards = scoreboard.rebuild_scoreboards()
+logger.info(f"Scoreboards rebuilt ({boards} boards).")
+
+from ..utils import feed
+expired = feed.trim_events()
+logger.info(f"Activity feed trimmed ({expired} expired events).")
 
 from ..utils import stats
-stats.get_container_stats()
-logger.info("Container stats cache warmed.")
+if stats.refresh_daily_stats():
+	logger.info("Dojo daily stats rebuilt.")
 for dojo in Dojos.query:
 	stats.get_dojo_stats(dojo)
 	logger.info(f"Dojo stats cache warmed for {dojo.reference_id}.")
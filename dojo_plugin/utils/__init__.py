@@ -13,6 +13,7 @@ import bleach
 import docker
 import docker.errors
 from flask import current_app, Response, Markup, abort, g
+from CTFd.cache import cache
 from itsdangerous.url_safe import URLSafeSerializer
 from CTFd.exceptions import UserNotFoundException, UserTokenExpiredException
 from CTFd.models import db, Solves, Challenges, Users
@@ -26,8 +27,10 @@ from sqlalchemy.sql import or_
 from bleach.css_sanitizer import CSSSanitizer
 
 from ..config import WORKSPACE_NODES, MAC_HOSTNAME, MAC_USERNAME
-from ..models import Dojos, DojoMembers, DojoAdmins, DojoChallenges, WorkspaceTokens
+from ..models import Dojos, DojoMembers, DojoAdmins, DojoChallenges, WorkspacePlacements, WorkspaceTokens
 from . import mac_docker
+from .docker_clients import node_docker_client
+from .fanout import fan_out_nodes
 
 ID_REGEX = "^[A-Za-z0-9_.-]+$"
 def id_regex(s):
@@ -66,11 +69,12 @@ def get_all_containers(dojo=None):
     if dojo:
         filters["label"] = f"dojo.dojo_id={dojo.reference_id}"
 
-    return [
-        container
-        for docker_client in all_docker_clients()
-        for container in docker_client.containers.list(filters=filters, ignore_removed=True)
-    ]
+    def list_containers(node_id, docker_client):
+        return docker_client.containers.list(filters=filters, ignore_removed=True)
+
+    # Nodes that fail or time out are logged and left out, rather than failing the whole listing
+    results, _ = fan_out_nodes(list_containers)
+    return [container for containers in results.values() for container in containers]
 
 
 def serialize_user_flag(account_id, challenge_id, *, secret=None):
@@ -83,7 +87,18 @@ def serialize_user_flag(account_id, challenge_id, *, secret=None):
 
 
 def user_node(user):
-    return list(WORKSPACE_NODES.keys())[user.id % len(WORKSPACE_NODES)] if WORKSPACE_NODES else None
+    if not WORKSPACE_NODES:
+        return None
+    # Chosen per start by utils/placement.py and stored in workspace_placements, with the cache in front of it (-1 when
+    # there is no placement); users who have not started since keep their original node
+    node_id = cache.get(f"user_{user.id}-node")
+    if node_id is None:
+        placement = WorkspacePlacements.query.get(user.id)
+        node_id = placement.node_id if placement else -1
+        cache.set(f"user_{user.id}-node", node_id, timeout=0)
+    if node_id in WORKSPACE_NODES:
+        return node_id
+    return list(WORKSPACE_NODES.keys())[user.id % len(WORKSPACE_NODES)]
 
 
 def user_docker_client(user, image_name=None):
@@ -92,14 +107,7 @@ def user_docker_client(user, image_name=None):
                                           username=MAC_USERNAME,
                                           key_path="/var/mac/key")
 
-    node_id = user_node(user)
-    return (docker.DockerClient(base_url=f"tcp://192.168.42.{node_id + 1}:2375", tls=False)
-            if node_id is not None else docker.from_env())
-
-
-def all_docker_clients():
-    return [docker.DockerClient(base_url=f"tcp://192.168.42.{node_id + 1}:2375", tls=False)
-            for node_id in WORKSPACE_NODES] if WORKSPACE_NODES else [docker.from_env()]
+    return node_docker_client(user_node(user))
 
 
 def user_ipv4(user):
@@ -178,7 +186,14 @@ def unserialize_user_flag(user_flag, *, secret=None):
     return account_id, challenge_id
 
 
-def resolved_tar(dir, *, root_dir, filter=None):
+def setuid_root_tarinfo(tarinfo):
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = "root"
+    tarinfo.mode = 0o4755
+    return tarinfo
+
+
+def resolved_tar(dir, *, root_dir, filter=None, tarinfo_filter=None):
     tar_buffer = io.BytesIO()
     tar = tarfile.open(fileobj=tar_buffer, mode='w')
     resolved_root_dir = root_dir.resolve()
@@ -189,9 +204,9 @@ def resolved_tar(dir, *, root_dir, filter=None):
         if path.is_symlink():
             resolved_path = path.resolve()
             assert resolved_path.is_relative_to(resolved_root_dir), f"The symlink {path} points outside of the root directory"
-            tar.add(resolved_path, arcname=relative_path)
+            tar.add(resolved_path, arcname=relative_path, filter=tarinfo_filter)
         else:
-            tar.add(path, arcname=relative_path, recursive=False)
+            tar.add(path, arcname=relative_path, recursive=False, filter=tarinfo_filter)
     tar_buffer.seek(0)
     return tar_buffer
 
@@ -0,0 +1,118 @@
+import datetime
+import time
+
+
+from ..models import DojoChallenges
+from . import get_current_container, user_node
+from .fanout import fan_out_nodes
+from .redis_client import get_redis_client
+
+# The workspace container sleeps for 6 hours before exiting, so records can never outlive that
+ACTIVE_WORKSPACE_TIMEOUT = int(datetime.timedelta(hours=6).total_seconds())
+
+
+def active_workspace_key(user_id):
+    return f"active_workspace:{user_id}"
+
+
+def workspace_record(dojo_challenge, *, container_id, mode, node, as_user_id):
+    return {
+        "dojo": dojo_challenge.dojo.reference_id,
+        "module": dojo_challenge.module.id,
+        "challenge": dojo_challenge.id,
+        "dojo_id": dojo_challenge.dojo_id,
+        "module_index": dojo_challenge.module_index,
+        "challenge_index": dojo_challenge.challenge_index,
+        "challenge_id": dojo_challenge.challenge_id,
+        "container": container_id,
+        "mode": mode,
+        "node": "" if node is None else node,
+        "as_user": as_user_id,
+        "started": time.time(),
+    }
+
+
+def record_from_container(container, node):
+    dojo_challenge = DojoChallenges.from_id(container.labels["dojo.dojo_id"],
+                                            container.labels["dojo.module_id"],
+                                            container.labels["dojo.challenge_id"]).first()
+    if not dojo_challenge:
+        return None
+    return workspace_record(dojo_challenge,
+                            container_id=container.id,
+                            mode=container.labels.get("dojo.mode", "standard"),
+                            node=node,
+                            as_user_id=container.labels.get("dojo.as_user_id", container.labels["dojo.user_id"]))
+
+
+def write_workspace_record(redis_client, user_id, record):
+    key = active_workspace_key(user_id)
+    pipeline = redis_client.pipeline()
+    pipeline.delete(key)
+    pipeline.hset(key, mapping=record or {"container": ""})
+    pipeline.expire(key, ACTIVE_WORKSPACE_TIMEOUT)
+    pipeline.execute()
+
+
+def set_active_workspace(user, dojo_challenge, container, *, practice, as_user):
+    record = workspace_record(dojo_challenge,
+                              container_id=container.id,
+                              mode="privileged" if practice else "standard",
+                              node=user_node(user),
+                              as_user_id=as_user.id)
+    write_workspace_record(get_redis_client(), user.id, record)
+
+
+def clear_active_workspace(user):
+    write_workspace_record(get_redis_client(), user.id, None)
+
+
+def get_active_workspace(user):
+    # Returns the active workspace record for the user, or None if there is no workspace running
+    redis_client = get_redis_client()
+    record = redis_client.hgetall(active_workspace_key(user.id))
+    if not record:
+        container = get_current_container(user)
+        record = record_from_container(container, user_node(user)) if container else None
+        write_workspace_record(redis_client, user.id, record)
+    return record if record and record.get("container") else None
+
+
+def get_active_dojo_challenge(user):
+    record = get_active_workspace(user)
+    if not record:
+        return None
+    dojo_challenge = DojoChallenges.query.get((int(record["dojo_id"]), int(record["module_index"]), int(record["challenge_index"])))
+    if dojo_challenge and dojo_challenge.id == record["challenge"] and dojo_challenge.challenge_id == int(record["challenge_id"]):
+        return dojo_challenge
+    # The dojo was updated since the workspace started, and its challenges were reindexed
+    return DojoChallenges.from_id(record["dojo"], record["module"], record["challenge"]).first()
+
+
+def reconcile_active_workspaces():
+    redis_client = get_redis_client()
+    sweep_start = time.time()
+
+    def list_containers(node_id, docker_client):
+        return docker_client.containers.list(filters=dict(status="running", label="dojo.user_id"), ignore_removed=True)
+
+    results, failures = fan_out_nodes(list_containers)
+    running = {}
+    for node_id, containers in results.items():
+        for container in containers:
+            running[container.labels["dojo.user_id"]] = (container, node_id)
+    # We cannot tell whether workspaces on a node we failed to list are still running, so leave their records alone
+    failed_nodes = {"" if node_id is None else str(node_id) for node_id in failures}
+
+    for user_id, (container, node_id) in running.items():
+        if redis_client.hget(active_workspace_key(user_id), "container") != container.id:
+            write_workspace_record(redis_client, user_id, record_from_container(container, node_id))
+
+    for key in redis_client.scan_iter(active_workspace_key("*")):
+        user_id = key.rsplit(":", 1)[1]
+        container_id, started, node = redis_client.hmget(key, "container", "started", "node")
+        if not container_id or user_id in running or float(started or 0) > sweep_start or node in failed_nodes:
+            continue
+        write_workspace_record(redis_client, user_id, None)
+
+    return len(running)
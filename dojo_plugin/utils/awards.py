@@ -5,10 +5,30 @@ from CTFd.models import db, Users
 from flask import url_for
 
 from .discord import get_discord_roles, get_discord_member, add_role, send_message
-from ..models import Dojos, Belts, Emojis, DiscordUsers
-from .feed import publish_belt_earned, publish_emoji_earned
+from ..config import AWARDS_QUEUE
+from ..models import Dojos, DojoChallenges, Belts, Emojis, DiscordUsers
+from .completion import dojo_completed
+from .feed import count_solve, publish_belt_earned, publish_challenge_solve, publish_emoji_earned
+from .redis_client import get_redis_client
 
 
+# Award evaluation is queued per user: repeated solves before a worker gets to the user only grow the user's set
+# of solved challenges ("*" evaluates every dojo). The worker resolves the challenges to their dojos and publishes
+# their feed events, so the solve path only records the challenge id. Claimed users stay on the processing list
+# until evaluated, and are requeued by recover_award_queue if a worker dies mid-evaluation.
+AWARDS_QUEUE_KEY = "awards:queue"
+AWARDS_PROCESSING_KEY = "awards:processing"
+AWARDS_PENDING_KEY = "awards:pending"
+
+CLAIM_AWARDS_SCRIPT = """
+redis.call("SREM", KEYS[1], ARGV[1])
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    redis.call("SUNIONSTORE", KEYS[3], KEYS[3], KEYS[2])
+    redis.call("DEL", KEYS[2])
+end
+return redis.call("SMEMBERS", KEYS[3])
+"""
+
 BELT_ORDER = [ "orange", "yellow", "green", "purple", "blue", "brown", "red", "black" ]
 BELT_REQUIREMENTS = {
     "orange": "intro-to-cybersecurity",
@@ -17,13 +37,13 @@ BELT_REQUIREMENTS = {
     "blue": "software-exploitation",
 }
 
-def get_user_emojis(user):
+def get_user_emojis(user, dojos=None):
     emojis = [ ]
-    for dojo in Dojos.query.all():
+    for dojo in (Dojos.query.all() if dojos is None else dojos):
         emoji = dojo.award and dojo.award.get('emoji', None)
         if not emoji:
             continue
-        if dojo.challenges and dojo.completed(user):
+        if dojo.challenges and dojo_completed(dojo, user):
             emojis.append((emoji, dojo.name or dojo.reference_id, dojo.hex_dojo_id))
     return emojis
 
@@ -109,13 +129,17 @@ def get_viewable_emojis(user):
     
     return result
 
-def update_awards(user):
+def update_awards(user, dojos=None):
+    # When dojos is given, only awards for completing those dojos are considered
+    belt_dojos = dojos is None or any(dojo.official and dojo.id in BELT_REQUIREMENTS.values() for dojo in dojos)
     current_belts = [belt.name for belt in Belts.query.filter_by(user=user)]
     for belt, dojo_id in BELT_REQUIREMENTS.items():
+        if not belt_dojos:
+            break
         if belt in current_belts:
             continue
         dojo = Dojos.query.filter(Dojos.official, Dojos.id == dojo_id).first()
-        if not (dojo and dojo.completed(user)):
+        if not (dojo and dojo_completed(dojo, user)):
             break
         db.session.add(Belts(user=user, name=belt))
         db.session.commit()
@@ -138,7 +162,7 @@ def update_awards(user):
         send_message(f"<@{discord_user.discord_id}> earned their {belt_role}! :tada:", "belting-ceremony")
         cache.delete_memoized(get_discord_member, discord_user.discord_id)
 
-    current_emojis = get_user_emojis(user)
+    current_emojis = get_user_emojis(user, dojos)
     for emoji,dojo_display_name,hex_dojo_id in current_emojis:
         emoji_award = Emojis.query.filter(Emojis.user==user, Emojis.category==hex_dojo_id, Emojis.name != "STALE").first()
         if emoji_award:
@@ -156,3 +180,86 @@ def update_awards(user):
         if dojo.official or dojo.data.get("type") == "public":
             publish_emoji_earned(user, emoji, display_name, description, 
                                dojo_id=dojo.reference_id, dojo_name=display_name)
+
+
+def update_awards_for(user, dojo_ids=None):
+    dojos = None if dojo_ids is None else Dojos.query.filter(Dojos.dojo_id.in_(dojo_ids)).all()
+    update_awards(user, dojos)
+
+
+def publish_solve(user, challenge_id):
+    first_blood = count_solve(challenge_id) == 1
+    dojo_challenge = DojoChallenges.query.filter_by(challenge_id=challenge_id).first()
+    if dojo_challenge:
+        dojo = dojo_challenge.module.dojo
+        if dojo.official or dojo.data.get("type") == "public":
+            module = dojo_challenge.module
+            points = dojo_challenge.challenge.value
+            publish_challenge_solve(user, dojo_challenge, dojo, module, points, first_blood)
+
+
+def evaluate_awards(user_id, claimed):
+    user = Users.query.filter_by(id=int(user_id)).first()
+    if not user:
+        return
+    challenge_ids = [int(challenge_id) for challenge_id in claimed if challenge_id != "*"]
+    for challenge_id in challenge_ids:
+        publish_solve(user, challenge_id)
+    if "*" in claimed:
+        update_awards_for(user)
+    elif challenge_ids:
+        dojo_ids = [dojo_id for dojo_id, in (
+            DojoChallenges.query
+            .filter(DojoChallenges.challenge_id.in_(challenge_ids), DojoChallenges.required)
+            .with_entities(DojoChallenges.dojo_id)
+            .distinct()
+        )]
+        update_awards_for(user, dojo_ids)
+
+
+def enqueue_awards(user_id, members):
+    if AWARDS_QUEUE == "local":
+        evaluate_awards(user_id, members)
+        return
+
+    redis_client = get_redis_client()
+    pipeline = redis_client.pipeline()
+    pipeline.sadd(f"awards:challenges:{user_id}", *members)
+    pipeline.sadd(AWARDS_PENDING_KEY, user_id)
+    if pipeline.execute()[-1]:
+        redis_client.lpush(AWARDS_QUEUE_KEY, user_id)
+
+
+def queue_awards(user):
+    enqueue_awards(user.id, ["*"])
+
+
+def queue_solve(user_id, challenge_id):
+    enqueue_awards(user_id, [challenge_id])
+
+
+def recover_award_queue():
+    redis_client = get_redis_client()
+    recovered = 0
+    while redis_client.rpoplpush(AWARDS_PROCESSING_KEY, AWARDS_QUEUE_KEY):
+        recovered += 1
+    return recovered
+
+
+def process_award_queue(timeout=30):
+    redis_client = get_redis_client()
+    user_id = redis_client.brpoplpush(AWARDS_QUEUE_KEY, AWARDS_PROCESSING_KEY, timeout=timeout)
+    if user_id is None:
+        return None
+
+    claim_awards = redis_client.register_script(CLAIM_AWARDS_SCRIPT)
+    claimed = claim_awards(keys=[AWARDS_PENDING_KEY, f"awards:challenges:{user_id}",
+                                 f"awards:challenges:{user_id}:processing"],
+                           args=[user_id])
+    evaluate_awards(user_id, claimed)
+
+    pipeline = redis_client.pipeline()
+    pipeline.delete(f"awards:challenges:{user_id}:processing")
+    pipeline.lrem(AWARDS_PROCESSING_KEY, 1, user_id)
+    pipeline.execute()
+    return user_id
@@ -0,0 +1,167 @@
+import datetime
+import logging
+
+import redis
+from CTFd.models import db, Solves
+from sqlalchemy import event
+from sqlalchemy.orm.session import Session
+
+from ..models import DojoChallenges, DojoUsers
+from .redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Each user's progress through a dojo is a bitmap of its solved required challenges. Bit 0 marks the bitmap as
+# built from the database; solves arriving before that are OR-ed in, so a concurrent build can never lose them.
+# Challenge bit positions are assigned per dojo generation, which is bumped whenever the dojo's challenges change.
+COMPLETION_TIMEOUT = int(datetime.timedelta(days=7).total_seconds())
+
+SET_BIT_SCRIPT = """
+local bit = redis.call("HGET", KEYS[2], ARGV[1])
+if bit then
+    redis.call("SETBIT", KEYS[1], bit, 1)
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+"""
+
+
+def completion_prefix(redis_client, dojo_id):
+    return f"completion:{dojo_id}:{redis_client.get(f'completion:{dojo_id}:generation') or 0}"
+
+
+def build_challenge_bits(redis_client, prefix, dojo_id):
+    challenge_ids = (
+        DojoChallenges.query
+        .filter(DojoChallenges.dojo_id == dojo_id, DojoChallenges.required)
+        .with_entities(DojoChallenges.challenge_id)
+        .distinct()
+        .order_by(DojoChallenges.challenge_id)
+        .all()
+    )
+    bits = {challenge_id: bit for bit, (challenge_id,) in enumerate(challenge_ids, start=1)}
+    pipeline = redis_client.pipeline()
+    pipeline.hset(f"{prefix}:challenges", mapping={"count": len(bits), **bits})
+    pipeline.expire(f"{prefix}:challenges", COMPLETION_TIMEOUT)
+    pipeline.execute()
+    return len(bits)
+
+
+def build_user_bits(redis_client, prefix, dojo_id, user_id):
+    bits = redis_client.hgetall(f"{prefix}:challenges")
+    solved_ids = (
+        Solves.query
+        .filter(Solves.user_id == user_id,
+                Solves.challenge_id.in_([int(challenge_id) for challenge_id in bits if challenge_id != "count"]))
+        .with_entities(Solves.challenge_id)
+        .distinct()
+        .all()
+    )
+    key = f"{prefix}:{user_id}"
+    pipeline = redis_client.pipeline()
+    for bit in [0, *(int(bits[str(challenge_id)]) for challenge_id, in solved_ids)]:
+        pipeline.setbit(key, bit, 1)
+    pipeline.expire(key, COMPLETION_TIMEOUT)
+    pipeline.bitcount(key)
+    return pipeline.execute()[-1]
+
+
+def dojo_completed(dojo, user):
+    if not (dojo.official or dojo.data.get("type") == "public" or
+            DojoUsers.query.filter_by(dojo_id=dojo.dojo_id, user_id=user.id).first()):
+        return False
+
+    redis_client = get_redis_client()
+    prefix = completion_prefix(redis_client, dojo.dojo_id)
+    pipeline = redis_client.pipeline()
+    pipeline.hget(f"{prefix}:challenges", "count")
+    pipeline.getbit(f"{prefix}:{user.id}", 0)
+    pipeline.bitcount(f"{prefix}:{user.id}")
+    required_count, built, solved_count = pipeline.execute()
+
+    if required_count is None:
+        required_count = build_challenge_bits(redis_client, prefix, dojo.dojo_id)
+        built = False
+    if not built:
+        solved_count = build_user_bits(redis_client, prefix, dojo.dojo_id, user.id)
+    return solved_count - 1 == int(required_count)
+
+
+def invalidate_completions(dojo_id):
+    get_redis_client().incr(f"completion:{dojo_id}:generation")
+
+
+def apply_completion_events(events):
+    redis_client = get_redis_client()
+    set_bit = redis_client.register_script(SET_BIT_SCRIPT)
+    for event_type, dojo_id, *args in events:
+        if event_type == "invalidate":
+            invalidate_completions(dojo_id)
+            continue
+        prefix = completion_prefix(redis_client, dojo_id)
+        user_id, challenge_id = args
+        if event_type == "solve":
+            set_bit(keys=[f"{prefix}:{user_id}", f"{prefix}:challenges"], args=[challenge_id, COMPLETION_TIMEOUT])
+        elif event_type == "unsolve":
+            redis_client.delete(f"{prefix}:{user_id}")
+
+
+def queue_completion_event(target, *event_args):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("completion_events", []).append(event_args)
+
+
+def required_dojo_ids(connection, challenge_id):
+    return connection.execute(
+        db.select(DojoChallenges.dojo_id)
+        .where(DojoChallenges.challenge_id == challenge_id, DojoChallenges.required)
+        .distinct()
+    ).scalars().all()
+
+
+@event.listens_for(Solves, "after_insert", propagate=True)
+def hook_solve_insert(mapper, connection, target):
+    for dojo_id in required_dojo_ids(connection, target.challenge_id):
+        queue_completion_event(target, "solve", dojo_id, target.user_id, target.challenge_id)
+
+
+@event.listens_for(Solves, "after_delete", propagate=True)
+def hook_solve_delete(mapper, connection, target):
+    for dojo_id in required_dojo_ids(connection, target.challenge_id):
+        queue_completion_event(target, "unsolve", dojo_id, target.user_id, target.challenge_id)
+
+
+@event.listens_for(DojoChallenges, "after_insert", propagate=True)
+@event.listens_for(DojoChallenges, "after_delete", propagate=True)
+def hook_dojo_challenge_change(mapper, connection, target):
+    queue_completion_event(target, "invalidate", target.dojo_id)
+
+
+@event.listens_for(DojoChallenges, "after_update", propagate=True)
+def hook_dojo_challenge_update(mapper, connection, target):
+    if Session.object_session(target).is_modified(target, include_collections=False):
+        queue_completion_event(target, "invalidate", target.dojo_id)
+
+
+@event.listens_for(Session, "after_commit")
+def hook_session_commit(session):
+    # The commit has already happened, so a Redis failure must not surface to the caller; bumping the generation of
+    # the affected dojos makes every bitmap in them rebuild from the database instead
+    events = session.info.pop("completion_events", None)
+    if not events:
+        return
+    try:
+        apply_completion_events(list(dict.fromkeys(events)))
+    except redis.RedisError as e:
+        dojo_ids = sorted({dojo_id for _, dojo_id, *_ in events})
+        logger.warning(f"Failed to apply completion events for dojos {dojo_ids}, invalidating them: {e}")
+        try:
+            for dojo_id in dojo_ids:
+                invalidate_completions(dojo_id)
+        except redis.RedisError as e:
+            logger.error(f"Failed to invalidate completions for dojos {dojo_ids}: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def hook_session_rollback(session):
+    session.info.pop("completion_events", None)
@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+
+import docker
+import docker.errors
+import requests
+
+# Also bind-mounted into the sshd, watchdog and registry containers (see docker-compose.yml), so this module must only
+# depend on docker and requests
+
+HEALTH_CHECK_INTERVAL = 30
+MAX_POOL_SIZE = int(os.environ.get("DOCKER_CLIENT_POOL_SIZE", "32"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _reset_clients():
+    global _clients_lock
+    _clients.clear()
+    _clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_clients)
+
+
+def node_base_url(node_id):
+    return f"tcp://192.168.42.{node_id + 1}:2375"
+
+
+def healthy(client):
+    try:
+        return client.ping()
+    except (docker.errors.DockerException, requests.exceptions.RequestException):
+        return False
+
+
+def node_docker_client(node_id=None, **kwargs):
+    # Clients are shared across threads (e.g. fan-outs), so a client is only ever dropped from the registry, never
+    # closed: another thread may still be using it, and it is closed once nothing references it
+    key = (node_id, *sorted(kwargs.items()))
+    with _clients_lock:
+        client, checked_at = _clients.get(key, (None, 0))
+
+    if client is not None:
+        if time.monotonic() - checked_at < HEALTH_CHECK_INTERVAL:
+            return client
+        is_healthy = healthy(client)
+        with _clients_lock:
+            if _clients.get(key, (None,))[0] is client:
+                if is_healthy:
+                    _clients[key] = (client, time.monotonic())
+                else:
+                    del _clients[key]
+        if is_healthy:
+            return client
+
+    kwargs.setdefault("max_pool_size", MAX_POOL_SIZE)
+    if node_id is None:
+        new_client = docker.from_env(**kwargs)
+    else:
+        new_client = docker.DockerClient(base_url=node_base_url(node_id), tls=False, **kwargs)
+    with _clients_lock:
+        client, _ = _clients.setdefault(key, (new_client, time.monotonic()))
+    if client is not new_client:
+        # Another thread registered a client first; this one was never handed out
+        new_client.close()
+    return client
@@ -24,7 +24,10 @@ from CTFd.utils.user import get_current_user, is_admin
 
 from ..models import DojoAdmins, Dojos, DojoModules, DojoChallenges, DojoResources, DojoChallengeVisibilities, DojoResourceVisibilities, DojoModuleVisibilities
 from ..config import DOJOS_DIR
-from ..utils import get_current_container, sanitize_survey
+from ..utils import sanitize_survey
+from ..utils.active_workspace import get_active_dojo_challenge
+from ..utils.scores import mark_scores_stale
+from ..utils.tar_cache import invalidate_tar_cache
 
 
 DOJOS_TMP_DIR = DOJOS_DIR/"tmp"
@@ -67,6 +70,7 @@ DOJO_SPEC = Schema({
     Optional("image"): IMAGE_REGEX,
     Optional("privileged"): bool,
     Optional("allow_privileged"): bool,
+    Optional("fixup_permissions"): bool,
     Optional("show_scoreboard"): bool,
     Optional("importable"): bool,
     Optional("interfaces"): INTERFACES_LIST,
@@ -92,6 +96,7 @@ DOJO_SPEC = Schema({
         Optional("image"): IMAGE_REGEX,
         Optional("privileged"): bool,
         Optional("allow_privileged"): bool,
+        Optional("fixup_permissions"): bool,
         Optional("show_challenges"): bool,
         Optional("show_scoreboard"): bool,
         Optional("importable"): bool,
@@ -141,6 +146,7 @@ DOJO_SPEC = Schema({
                 Optional("image"): IMAGE_REGEX,
                 Optional("privileged"): bool,
                 Optional("allow_privileged"): bool,
+                Optional("fixup_permissions"): bool,
                 Optional("importable"): bool,
                 Optional("progression_locked"): bool,
                 Optional("auxiliary"): dict,
@@ -467,6 +473,7 @@ def dojo_from_spec(data, *, dojo_dir=None, dojo=None):
                     image=shadow("image", dojo_data, module_data, challenge_data, default=None),
                     privileged=shadow("privileged", dojo_data, module_data, challenge_data, default_dict=DojoChallenges.data_defaults),
                     allow_privileged=shadow("allow_privileged", dojo_data, module_data, challenge_data, default_dict=DojoChallenges.data_defaults),
+                    fixup_permissions=shadow("fixup_permissions", dojo_data, module_data, challenge_data, default_dict=DojoChallenges.data_defaults),
                     importable=shadow("importable", dojo_data, module_data, challenge_data, default_dict=DojoChallenges.data_defaults),
                     interfaces=shadow("interfaces", dojo_data, module_data, challenge_data, default_dict=DojoChallenges.data_defaults),
                     challenge=challenge(
@@ -665,6 +672,8 @@ def dojo_create(user, repository, public_key, private_key, spec):
         dojo.path.parent.mkdir(exist_ok=True)
         dojo_path.rename(dojo.path)
         dojo_path.mkdir()  # TODO: ignore_cleanup_errors=True
+        invalidate_tar_cache(dojo)
+        mark_scores_stale([dojo.dojo_id])
 
     except subprocess.CalledProcessError as e:
         deploy_url = f"https://github.com/{repository}/settings/keys"
@@ -706,6 +715,8 @@ def dojo_update(dojo):
     else:
         tmpdir = dojo_clone(dojo.repository, dojo.private_key)
         os.rename(tmpdir.name, str(dojo.path))
+    invalidate_tar_cache(dojo)
+    mark_scores_stale([dojo.dojo_id])
     return dojo_from_dir(dojo.path, dojo=dojo)
 
 
@@ -753,14 +764,7 @@ def dojo_route(func):
 
 
 def get_current_dojo_challenge(user=None):
-    container = get_current_container(user)
-    if not container:
+    user = user or get_current_user()
+    if not user:
         return None
-
-    return (
-        DojoChallenges.query
-        .filter(DojoChallenges.id == container.labels.get("dojo.challenge_id"),
-                DojoChallenges.module == DojoModules.from_id(container.labels.get("dojo.dojo_id"), container.labels.get("dojo.module_id")).first(),
-                DojoChallenges.dojo == Dojos.from_id(container.labels.get("dojo.dojo_id")).first())
-        .first()
-    )
+    return get_active_dojo_challenge(user)
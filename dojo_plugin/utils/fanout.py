@@ -0,0 +1,68 @@
+import concurrent.futures
+import functools
+import logging
+import os
+
+from flask import current_app, has_app_context
+
+from ..config import NODE_FANOUT_TIMEOUT, WORKSPACE_NODES
+from .docker_clients import node_docker_client
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+os.register_at_fork(after_in_child=_executors.clear)
+
+
+def get_executor():
+    if not _executors:
+        _executors[None] = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(WORKSPACE_NODES), 8) * 4,
+                                                                 thread_name_prefix="fanout")
+    return _executors[None]
+
+
+def in_app_context(func):
+    if not has_app_context():
+        return func
+    app = current_app._get_current_object()
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with app.app_context():
+            return func(*args)
+    return wrapper
+
+
+def fan_out(func, targets, *, timeout=NODE_FANOUT_TIMEOUT):
+    # Calls func(target) for every {key: target} in parallel, returning ({key: result}, {key: exception}); a target
+    # that misses the deadline is reported as failed while the others still return their results
+    call = in_app_context(func)
+    futures = {key: get_executor().submit(call, target) for key, target in targets.items()}
+    concurrent.futures.wait(futures.values(), timeout=timeout)
+
+    results, failures = {}, {}
+    for key, future in futures.items():
+        if not future.done():
+            future.cancel()
+            failures[key] = TimeoutError(f"No response after {timeout} seconds")
+        elif future.exception() is not None:
+            failures[key] = future.exception()
+        else:
+            results[key] = future.result()
+    for key, error in failures.items():
+        logger.warning(f"{getattr(func, '__name__', func)} failed on {key}: {error!r}")
+    return results, failures
+
+
+def all_node_ids():
+    return list(WORKSPACE_NODES) or [None]
+
+
+def fan_out_nodes(func, node_ids=None, *, timeout=NODE_FANOUT_TIMEOUT):
+    # Calls func(node_id, docker_client) on every workspace node (or just the local docker when there are none)
+    @functools.wraps(func)
+    def call(node_id):
+        return func(node_id, node_docker_client(node_id))
+
+    node_ids = all_node_ids() if node_ids is None else node_ids
+    return fan_out(call, {node_id: node_id for node_id in node_ids}, timeout=timeout)
@@ -5,23 +5,125 @@ from datetime import datetime, timezone
 from typing import Dict, Optional, Any
 
 import redis
-from flask import current_app
-from CTFd.models import Users
+from sqlalchemy import event as sqlalchemy_event
+from sqlalchemy.orm.session import Session
+from CTFd.cache import cache
+from CTFd.models import Awards, Solves, Users
+from .redis_client import get_redis_client
 
-def get_redis_client() -> redis.Redis:
-    redis_url = current_app.config.get("REDIS_URL", "redis://cache:6379")
-    return redis.from_url(redis_url, decode_responses=True)
+# Solve counts only decide first blood; they are resynced from the database daily in case solves were removed
+SOLVE_COUNT_TTL = 86400
+
+INCREMENT_SOLVE_COUNT_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return redis.call("INCR", KEYS[1])
+end
+return false
+"""
+
+# Events are stored compactly: sorted sets hold event ids scored by publish time, and each body is a separate key
+# that expires after FEED_EVENT_TTL. Besides the global set, every event is indexed per dojo and per user, and
+# published on the global and per-dojo channels. Writes trim each set to FEED_MAX_EVENTS atomically; expired events
+# are trimmed from the global set by the cache warmer, and from the indexes as they are written to.
+FEED_EVENTS_KEY = "activity_feed:events"
+FEED_BODY_PREFIX = "activity_feed:event:"
+FEED_LIVE_CHANNEL = "activity_feed:live"
+# Scores double as event ids and cursors, so each event is scored strictly above the last one published
+FEED_LAST_SCORE_KEY = "activity_feed:last_score"
+
+ADD_EVENT_SCRIPT = """
+local score = tonumber(ARGV[2])
+local last_score = tonumber(redis.call("GET", KEYS[2]) or "0")
+if score <= last_score then
+    score = last_score + 0.000001
+end
+score = string.format("%.17g", score)
+redis.call("SET", KEYS[2], score)
+redis.call("SET", KEYS[1], ARGV[3], "EX", ARGV[5])
+for i = 3, #KEYS do
+    redis.call("ZADD", KEYS[i], score, ARGV[1])
+    redis.call("ZREMRANGEBYRANK", KEYS[i], 0, -tonumber(ARGV[4]) - 1)
+    if i > 3 then
+        redis.call("ZREMRANGEBYSCORE", KEYS[i], "-inf", tonumber(score) - tonumber(ARGV[5]))
+        redis.call("EXPIRE", KEYS[i], ARGV[5])
+    end
+end
+for i = 6, #ARGV do
+    redis.call("PUBLISH", ARGV[i], score .. " " .. ARGV[3])
+end
+return score
+"""
+
+TRIM_EVENTS_SCRIPT = """
+return redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+"""
+
+RECENT_EVENTS_SCRIPT = """
+local entries = redis.call("ZREVRANGEBYSCORE", KEYS[1], ARGV[1], ARGV[2], "WITHSCORES", "LIMIT", 0, ARGV[3])
+local result = {}
+for i = 1, #entries, 2 do
+    result[#result + 1] = redis.call("GET", ARGV[4] .. entries[i]) or ""
+    result[#result + 1] = entries[i + 1]
+end
+return result
+"""
+
+def feed_events_key(dojo: Optional[str] = None, user_id: Optional[int] = None) -> str:
+    if user_id is not None:
+        return f"{FEED_EVENTS_KEY}:user:{user_id}"
+    if dojo is not None:
+        return f"{FEED_EVENTS_KEY}:dojo:{dojo}"
+    return FEED_EVENTS_KEY
+
+def feed_live_channel(dojo: Optional[str] = None) -> str:
+    return f"{FEED_LIVE_CHANNEL}:dojo:{dojo}" if dojo is not None else FEED_LIVE_CHANNEL
+
+def event_matches(event: Dict[str, Any], dojo: Optional[str] = None, user_id: Optional[int] = None) -> bool:
+    return ((dojo is None or event.get("data", {}).get("dojo_id") == dojo) and
+            (user_id is None or event.get("user_id") == user_id))
+
+def count_solve(challenge_id: int) -> int:
+    r = get_redis_client()
+    key = f"solve_count:{challenge_id}"
+    count = r.register_script(INCREMENT_SOLVE_COUNT_SCRIPT)(keys=[key])
+    if count is None:
+        # the solve has already been committed, so it is included in the count
+        count = Solves.query.filter_by(challenge_id=challenge_id).count()
+        r.set(key, count, nx=True, ex=SOLVE_COUNT_TTL)
+    return count
+
+@cache.memoize(timeout=86400)
+def get_feed_profile(user_id: int):
+    from ..models import Belts, Emojis
+    from ..utils.awards import BELT_ORDER
+
+    user_belts = [b.name for b in Belts.query.filter_by(user_id=user_id)]
+    highest_belt = next((b for b in reversed(BELT_ORDER) if b in user_belts), None)
+    user_emojis = [e.name for e in Emojis.query.filter_by(user_id=user_id)]
+    return highest_belt, user_emojis
+
+@sqlalchemy_event.listens_for(Awards, "after_insert", propagate=True)
+@sqlalchemy_event.listens_for(Awards, "after_update", propagate=True)
+@sqlalchemy_event.listens_for(Awards, "after_delete", propagate=True)
+def hook_award_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("feed_profile_users", set()).add(target.user_id)
+
+@sqlalchemy_event.listens_for(Session, "after_commit")
+def hook_session_commit(session):
+    for user_id in session.info.pop("feed_profile_users", ()):
+        cache.delete_memoized(get_feed_profile, user_id)
+
+@sqlalchemy_event.listens_for(Session, "after_rollback")
+def hook_session_rollback(session):
+    session.info.pop("feed_profile_users", None)
 
 def create_event(event_type: str, user: Users, data: Dict[str, Any]) -> Optional[str]:
     if user.hidden:
         return None
     
-    from ..models import Belts, Emojis
-    from ..utils.awards import BELT_ORDER
-    
-    user_belts = [b.name for b in Belts.query.filter_by(user=user)]
-    highest_belt = next((b for b in reversed(BELT_ORDER) if b in user_belts), None)
-    user_emojis = [e.name for e in Emojis.query.filter_by(user=user)]
+    highest_belt, user_emojis = get_feed_profile(user.id)
     
     event = {
         "id": str(uuid.uuid4()),
@@ -35,28 +137,49 @@ def create_event(event_type: str, user: Users, data: Dict[str, Any]) -> Optional
     }
     
     try:
-        r = get_redis_client()
-        score = time.time()
-        r.zadd("activity_feed:events", {json.dumps(event): score})
-        
         from ..config import FEED_MAX_EVENTS, FEED_EVENT_TTL
-        r.zremrangebyrank("activity_feed:events", 0, -FEED_MAX_EVENTS - 1)
-        r.zremrangebyscore("activity_feed:events", "-inf", time.time() - FEED_EVENT_TTL)
-        r.publish("activity_feed:live", json.dumps(event))
+        score = time.time()
+        event_json = json.dumps(event, separators=(",", ":"))
+        dojo = data.get("dojo_id")
+        keys = [FEED_BODY_PREFIX + event["id"], FEED_LAST_SCORE_KEY, feed_events_key(), feed_events_key(user_id=user.id)]
+        channels = [feed_live_channel()]
+        if dojo is not None:
+            keys.append(feed_events_key(dojo=dojo))
+            channels.append(feed_live_channel(dojo))
+        # the score doubles as the SSE event id, so streams can resume from the sorted sets
+        get_redis_client().register_script(ADD_EVENT_SCRIPT)(
+            keys=keys,
+            args=[event["id"], repr(score), event_json, FEED_MAX_EVENTS, FEED_EVENT_TTL, *channels])
         
         return event["id"]
     except (redis.RedisError, redis.ConnectionError):
         return None
 
-def get_recent_events(limit: int = 50, offset: int = 0):
+def trim_events() -> int:
+    from ..config import FEED_EVENT_TTL
+    return get_redis_client().register_script(TRIM_EVENTS_SCRIPT)(
+        keys=[FEED_EVENTS_KEY], args=[repr(time.time() - FEED_EVENT_TTL)])
+
+def get_events_after(r: redis.Redis, score: float, limit: int, dojo: Optional[str] = None, user_id: Optional[int] = None):
+    # (score, event json) for events strictly newer than score, oldest first
+    entries = r.zrangebyscore(feed_events_key(dojo, user_id), f"({score!r}", "+inf", start=0, num=limit, withscores=True)
+    bodies = r.mget([FEED_BODY_PREFIX + event_id for event_id, _ in entries]) if entries else []
+    return [(score, body) for (_, score), body in zip(entries, bodies)
+            if body is not None and event_matches(json.loads(body), dojo, user_id)]
+
+def get_recent_events(limit: int = 50, before: Optional[str] = None, dojo: Optional[str] = None, user_id: Optional[int] = None):
+    # Newest first, starting after the cursor; returns (events, cursor for the next page)
     try:
-        r = get_redis_client()
         from ..config import FEED_EVENT_TTL
-        r.zremrangebyscore("activity_feed:events", "-inf", time.time() - FEED_EVENT_TTL)
-        events = r.zrevrange("activity_feed:events", offset, offset + limit - 1)
-        return [json.loads(e) for e in events]
+        entries = get_redis_client().register_script(RECENT_EVENTS_SCRIPT)(
+            keys=[feed_events_key(dojo, user_id)],
+            args=[f"({before}" if before else "+inf", repr(time.time() - FEED_EVENT_TTL), limit, FEED_BODY_PREFIX])
+        events = [json.loads(body) for body in entries[0::2] if body]
+        # filtering on both dojo and user reads the user's index, so a page may come back short
+        events = [event for event in events if event_matches(event, dojo, user_id)]
+        return events, (entries[-1] if len(entries) // 2 == limit else None)
     except (redis.RedisError, redis.ConnectionError, json.JSONDecodeError):
-        return []
+        return [], None
 
 def publish_container_start(user: Users, mode: str, challenge_data: Dict) -> Optional[str]:
     return create_event("container_start", user, challenge_data | {"mode": mode})
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from ..config import FEED_CLIENT_QUEUE_SIZE, FEED_MAX_EVENTS
+from .feed import FEED_LIVE_CHANNEL, event_matches, get_events_after
+from .redis_client import get_redis_client
+
+# One Redis subscription per worker process, fanned out to a bounded queue per stream. A client that falls a full
+# queue behind is dropped; its browser reconnects with Last-Event-ID and catches up from activity_feed:events.
+# Keep the message format in sync with feed/feed_server.py.
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 30
+
+
+def parse_feed_message(message):
+    score, event_json = message.split(" ", 1)
+    return float(score), event_json
+
+
+def sse_message(data, event_id=None):
+    return (f"id: {event_id}\n" if event_id is not None else "") + f"data: {data}\n\n"
+
+
+class FeedClient:
+    def __init__(self, dojo=None, user_id=None):
+        self.queue = queue.Queue(maxsize=FEED_CLIENT_QUEUE_SIZE)
+        self.dojo = dojo
+        self.user_id = user_id
+        self.dropped = False
+
+    @property
+    def filtered(self):
+        return self.dojo is not None or self.user_id is not None
+
+
+class FeedHub:
+    def __init__(self, redis_url):
+        self.redis_url = redis_url
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="feed-hub", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                pubsub = get_redis_client(self.redis_url).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(FEED_LIVE_CHANNEL)
+                for message in pubsub.listen():
+                    self.broadcast(*parse_feed_message(message["data"]))
+            except Exception as e:
+                logger.warning("Feed hub lost its Redis subscription, resubscribing", exc_info=e)
+                time.sleep(1)
+
+    def broadcast(self, score, event_json):
+        with self.lock:
+            clients = list(self.clients)
+        event = json.loads(event_json) if any(client.filtered for client in clients) else None
+        for client in clients:
+            if client.filtered and not event_matches(event, client.dojo, client.user_id):
+                continue
+            try:
+                client.queue.put_nowait((score, event_json))
+            except queue.Full:
+                self.unregister(client)
+                client.dropped = True
+
+    def register(self, dojo=None, user_id=None):
+        self.start()
+        client = FeedClient(dojo, user_id)
+        with self.lock:
+            self.clients.add(client)
+        return client
+
+    def unregister(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def stream(self, last_event_id=None, dojo=None, user_id=None):
+        client = self.register(dojo, user_id)
+        try:
+            yield sse_message(json.dumps({"type": "connected"}))
+
+            last_score = None
+            try:
+                last_score = float(last_event_id) if last_event_id else None
+            except ValueError:
+                pass
+            if last_score is not None:
+                r = get_redis_client(self.redis_url)
+                for score, event_json in get_events_after(r, last_score, FEED_MAX_EVENTS, dojo, user_id):
+                    yield sse_message(event_json, repr(score))
+                    last_score = score
+
+            while not client.dropped:
+                try:
+                    score, event_json = client.queue.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield sse_message(json.dumps({"type": "heartbeat"}))
+                    continue
+                if last_score is not None and score <= last_score:
+                    continue
+                yield sse_message(event_json, repr(score))
+        finally:
+            self.unregister(client)
+
+
+_hub = None
+_hub_pid = None
+
+
+def feed_hub():
+    global _hub, _hub_pid
+    if _hub is None or _hub_pid != os.getpid():
+        _hub = FeedHub(current_app.config.get("REDIS_URL", "redis://cache:6379"))
+        _hub_pid = os.getpid()
+    return _hub
@@ -0,0 +1,80 @@
+import datetime
+
+import redis
+from CTFd.cache import cache
+
+from ..config import WORKSPACE_NODES
+from .redis_client import get_redis_client
+
+# Image configs (Env, and so PATH) are cached per node so that starting a workspace does not inspect its image, and
+# refreshed whenever pull_images pulls the image again. Each node's set of known images lets placement prefer a node
+# that already has the image without asking every node.
+IMAGE_CONFIG_TIMEOUT = int(datetime.timedelta(days=1).total_seconds())
+IMAGE_CONFIG_STATS_KEY = "image_config_cache:stats"
+
+
+def image_config_key(docker_client, image_name):
+    return f"image-config-{docker_client.api.base_url}-{image_name}"
+
+
+def node_images_key(node_id):
+    return f"node_images:{node_id}"
+
+
+def record_node_image(node_id, image_name):
+    if node_id is None:
+        return
+    try:
+        pipeline = get_redis_client().pipeline()
+        pipeline.sadd(node_images_key(node_id), image_name)
+        pipeline.expire(node_images_key(node_id), IMAGE_CONFIG_TIMEOUT)
+        pipeline.execute()
+    except redis.RedisError:
+        pass
+
+
+def nodes_with_image(image_name):
+    try:
+        pipeline = get_redis_client().pipeline()
+        for node_id in WORKSPACE_NODES:
+            pipeline.sismember(node_images_key(node_id), image_name)
+        return {node_id for node_id, present in zip(WORKSPACE_NODES, pipeline.execute()) if present}
+    except redis.RedisError:
+        return set()
+
+
+def image_config(docker_client, image_name, *, node_id=None):
+    key = image_config_key(docker_client, image_name)
+    config = cache.get(key)
+    try:
+        get_redis_client().hincrby(IMAGE_CONFIG_STATS_KEY, f"{image_name}:{'hit' if config is not None else 'miss'}", 1)
+    except redis.RedisError:
+        pass
+    if config is not None:
+        return config
+
+    config = docker_client.images.get(image_name).attrs["Config"]
+    cache.set(key, config, timeout=IMAGE_CONFIG_TIMEOUT)
+    record_node_image(node_id, image_name)
+    return config
+
+
+def refresh_image_config(docker_client, image, image_name, *, node_id=None):
+    # A re-pulled tag may have a new Env or PATH, so replace whatever config was cached for the old image
+    cache.set(image_config_key(docker_client, image_name), image.attrs["Config"], timeout=IMAGE_CONFIG_TIMEOUT)
+    record_node_image(node_id, image_name)
+
+
+def image_config_cache_stats():
+    try:
+        counters = get_redis_client().hgetall(IMAGE_CONFIG_STATS_KEY)
+    except redis.RedisError:
+        return {}
+    stats = {}
+    for field, value in counters.items():
+        image_name, _, kind = field.rpartition(":")
+        stats.setdefault(image_name, dict(hit=0, miss=0))[kind] = int(value)
+    for image_stats in stats.values():
+        total = image_stats["hit"] + image_stats["miss"]
+        image_stats["hit_rate"] = image_stats["hit"] / total if total else 0.0
+    return stats
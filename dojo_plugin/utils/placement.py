@@ -0,0 +1,136 @@
+import datetime
+import hashlib
+import logging
+
+import redis
+import requests
+from CTFd.cache import cache
+from CTFd.models import db
+from sqlalchemy.dialects.postgresql import insert
+
+from ..config import HOMEFS_URL, MIGRATION_TIMEOUT, PLACEMENT_TIMEOUT, PROMETHEUS_URL, WORKSPACE_NODES
+from ..models import WorkspacePlacements
+from . import user_node
+from .image_cache import nodes_with_image
+from .workspaces import workspaces_key
+from .redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# A node's score is its share of running workspaces relative to the mean, plus weighted CPU and memory stall (PSI,
+# seconds stalled per second), minus a bonus when the image is known to be on the node; the lowest score wins, and
+# rendezvous hashing breaks ties, so without any load data every user lands on a stable node. A user whose home volume
+# is active on a node stays there unless another node scores better by MIGRATION_MARGIN, which moves the volume.
+PRESSURE_WEIGHT = 2.0
+IMAGE_WEIGHT = 0.5
+MIGRATION_MARGIN = 1.0
+PRESSURE_QUERY = 'sum by (instance) (rate({__name__=~"node_pressure_(cpu|memory)_waiting_seconds_total"}[1m]))'
+
+
+def node_ip(node_id):
+    return f"192.168.42.{node_id + 1}"
+
+
+def rendezvous_weight(user_id, node_id):
+    return int.from_bytes(hashlib.sha256(f"{user_id}:{node_id}".encode()).digest()[:8], "big")
+
+
+def home_node(user):
+    # homefs pins an activated home volume to the node that activated it, until release_home_volume unpins it; when
+    # homefs cannot tell, assume the current node rather than risk a start that cannot mount its home
+    try:
+        response = requests.get(f"{HOMEFS_URL}/volume/{user.id}/host", timeout=PLACEMENT_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Failed to look up home volume of user {user.id}: {e}")
+        return user_node(user)
+    if response.status_code == 404:
+        return None
+    if not response.ok:
+        return user_node(user)
+    host = response.text.strip()
+    return next((node_id for node_id in WORKSPACE_NODES if node_ip(node_id) == host), None)
+
+
+def node_workspace_counts():
+    try:
+        pipeline = get_redis_client().pipeline()
+        for node_id in WORKSPACE_NODES:
+            pipeline.hlen(workspaces_key(node_id))
+        return dict(zip(WORKSPACE_NODES, pipeline.execute()))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to count workspaces per node: {e}")
+        return {}
+
+
+@cache.memoize(timeout=30)
+def node_pressure():
+    try:
+        response = requests.get(f"{PROMETHEUS_URL}/api/v1/query", params=dict(query=PRESSURE_QUERY),
+                                timeout=PLACEMENT_TIMEOUT)
+        response.raise_for_status()
+        results = response.json()["data"]["result"]
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.warning(f"Failed to query node pressure: {e}")
+        return {}
+    pressure = {result["metric"].get("instance", "").rsplit(":", 1)[0]: float(result["value"][1]) for result in results}
+    return {node_id: pressure[node_ip(node_id)] for node_id in WORKSPACE_NODES if node_ip(node_id) in pressure}
+
+
+def release_home_volume(user):
+    # homefs has the volume's node snapshot and release it, and takes that snapshot back to storage, so whichever node
+    # activates the volume next starts from the latest home
+    try:
+        response = requests.post(f"{HOMEFS_URL}/volume/{user.id}/deactivate", timeout=MIGRATION_TIMEOUT)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Failed to release home volume of user {user.id}: {e}")
+        return False
+    return True
+
+
+def node_scores(node_ids, *, counts, pressure, cached):
+    mean_count = max(sum(counts.values()) / len(node_ids), 1)
+    return {node_id: (counts.get(node_id, 0) / mean_count
+                      + PRESSURE_WEIGHT * pressure.get(node_id, 0)
+                      - IMAGE_WEIGHT * (node_id in cached))
+            for node_id in node_ids}
+
+
+def rank_nodes(user_id, node_ids, *, counts, pressure, cached):
+    # Best node first
+    scores = node_scores(node_ids, counts=counts, pressure=pressure, cached=cached)
+    return sorted(node_ids, key=lambda node_id: (scores[node_id], -rendezvous_weight(user_id, node_id)))
+
+
+def choose_node(user_id, node_ids, home_node_id, *, counts, pressure, cached):
+    best_node_id = rank_nodes(user_id, node_ids, counts=counts, pressure=pressure, cached=cached)[0]
+    if home_node_id not in node_ids:
+        return best_node_id
+    scores = node_scores(node_ids, counts=counts, pressure=pressure, cached=cached)
+    if scores[home_node_id] - scores[best_node_id] < MIGRATION_MARGIN:
+        return home_node_id
+    return best_node_id
+
+
+def place_workspace(user, image_name):
+    # Records the node for the user's next workspace; user_node (and so the workspace's IP, the nginx route and sshd)
+    # follows the recorded choice until the next start
+    if not WORKSPACE_NODES or image_name.startswith("mac:"):
+        return None
+    home_node_id = home_node(user)
+    node_id = choose_node(user.id, list(WORKSPACE_NODES), home_node_id,
+                          counts=node_workspace_counts(),
+                          pressure=node_pressure(),
+                          cached=nodes_with_image(image_name))
+    if home_node_id is not None and node_id != home_node_id and not release_home_volume(user):
+        node_id = home_node_id
+
+    # Written in its own transaction, so placing a workspace never commits the request's session
+    statement = insert(WorkspacePlacements).values(user_id=user.id, node_id=node_id, placed=datetime.datetime.utcnow())
+    with db.engine.begin() as connection:
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[WorkspacePlacements.user_id],
+            set_=dict(node_id=statement.excluded.node_id, placed=statement.excluded.placed),
+        ))
+    cache.set(f"user_{user.id}-node", node_id, timeout=0)
+    return node_id
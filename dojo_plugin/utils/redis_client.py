@@ -0,0 +1,16 @@
+import os
+
+import redis
+from flask import current_app
+
+# One client (and so one connection pool) per Redis URL per process; clients are thread-safe but must not cross a fork
+_clients = {}
+os.register_at_fork(after_in_child=_clients.clear)
+
+
+def get_redis_client(redis_url=None):
+    redis_url = redis_url or current_app.config.get("REDIS_URL", "redis://cache:6379")
+    client = _clients.get(redis_url)
+    if client is None:
+        client = _clients.setdefault(redis_url, redis.from_url(redis_url, decode_responses=True))
+    return client
@@ -0,0 +1,373 @@
+import datetime
+
+from CTFd.models import db, Solves, Users
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.session import Session
+
+from ..models import Dojos, DojoChallenges, DojoUsers, DojoModules, DojoChallengeVisibilities
+from .redis_client import get_redis_client
+
+# Boards are sorted sets of user ids, scored so that more solves rank first and, among equal solves,
+# the user who reached that count earliest (lowest last solve id) ranks first:
+#   score = solves * SOLVE_SCORE - last_solve_id
+SOLVE_SCORE = 2 ** 32
+SCOREBOARD_TIMEOUT = int(datetime.timedelta(hours=2).total_seconds())
+WINDOWED_SCOREBOARD_TIMEOUT = int(datetime.timedelta(minutes=10).total_seconds())
+# Boards for other durations are only kept fresh by rebuilds
+SCOREBOARD_DURATIONS = {0, 7, 30}
+# Windowed boards up to this many days are summed from per-day buckets, longer ones fall back to SQL
+BUCKET_RETENTION_DAYS = max(SCOREBOARD_DURATIONS) + 1
+
+ADD_SOLVE_SCRIPT = """
+if redis.call("exists", KEYS[2]) == 0 then
+    return 0
+end
+local solve_id = tonumber(ARGV[2])
+local score = tonumber(redis.call("zscore", KEYS[1], ARGV[1]) or "0")
+local solves, last_solve_id = 0, 0
+if score > 0 then
+    solves = math.floor(score / 4294967296) + 1
+    last_solve_id = solves * 4294967296 - score
+end
+if solve_id <= last_solve_id then
+    return 0
+end
+redis.call("zadd", KEYS[1], string.format("%.0f", (solves + 1) * 4294967296 - solve_id), ARGV[1])
+redis.call("pexpire", KEYS[1], redis.call("pttl", KEYS[2]))
+return 1
+"""
+
+
+# Buckets hold two sorted sets per day: solve counts, and the last solve id (for tie-breaking and dedupe)
+ADD_BUCKET_SOLVE_SCRIPT = """
+if redis.call("exists", KEYS[3]) == 0 then
+    return 0
+end
+local solve_id = tonumber(ARGV[2])
+if solve_id <= tonumber(redis.call("zscore", KEYS[2], ARGV[1]) or "0") then
+    return 0
+end
+redis.call("zincrby", KEYS[1], 1, ARGV[1])
+redis.call("zadd", KEYS[2], solve_id, ARGV[1])
+local ttl = redis.call("pttl", KEYS[3])
+redis.call("pexpire", KEYS[1], ttl)
+redis.call("pexpire", KEYS[2], ttl)
+return 1
+"""
+
+COMPOSE_BUCKETS_SCRIPT = """
+local days = tonumber(ARGV[1])
+local solves_args, last_args = {"zunionstore", KEYS[3], days}, {"zunionstore", KEYS[4], days}
+for i = 1, days do
+    table.insert(solves_args, KEYS[4 + i])
+    table.insert(last_args, KEYS[4 + days + i])
+end
+table.insert(last_args, "aggregate")
+table.insert(last_args, "max")
+redis.call(unpack(solves_args))
+redis.call(unpack(last_args))
+redis.call("del", KEYS[1])
+local members = redis.call("zrange", KEYS[3], 0, -1, "withscores")
+for i = 1, #members, 2 do
+    local last_solve_id = tonumber(redis.call("zscore", KEYS[4], members[i]))
+    redis.call("zadd", KEYS[1], string.format("%.0f", tonumber(members[i + 1]) * 4294967296 - last_solve_id), members[i])
+end
+redis.call("del", KEYS[3], KEYS[4])
+redis.call("expire", KEYS[1], ARGV[2])
+redis.call("set", KEYS[2], 1, "ex", ARGV[2])
+return #members / 2
+"""
+
+
+def solve_score(solves, last_solve_id):
+    return solves * SOLVE_SCORE - last_solve_id
+
+
+def score_solves(score):
+    return int(score // SOLVE_SCORE) + 1
+
+
+def scoreboard_timeout(duration):
+    return WINDOWED_SCOREBOARD_TIMEOUT if duration and not uses_buckets(duration) else SCOREBOARD_TIMEOUT
+
+
+def uses_buckets(duration):
+    return 0 < duration < BUCKET_RETENTION_DAYS
+
+
+def scoreboard_prefixes(redis_client, dojo_id, module_indexes):
+    global_generation, dojo_generation = redis_client.mget("scoreboard:generation", f"scoreboard:generation:{dojo_id}")
+    return [f"{global_generation or 0}:{dojo_generation or 0}:{dojo_id}:{'_' if module_index is None else module_index}"
+            for module_index in module_indexes]
+
+
+def model_prefix(redis_client, model):
+    module_index = model.module_index if isinstance(model, DojoModules) else None
+    return scoreboard_prefixes(redis_client, model.dojo_id, [module_index])[0]
+
+
+def scoreboard_key(redis_client, model, duration):
+    return f"scoreboard:{model_prefix(redis_client, model)}:{duration or 0}"
+
+
+def bucket_key(prefix, day):
+    return f"scoreboard-day:{prefix}:{day:%Y%m%d}"
+
+
+def scoreboard_solves(model, duration):
+    duration_filter = (
+        Solves.date >= datetime.datetime.utcnow() - datetime.timedelta(days=duration)
+        if duration else True
+    )
+    return (
+        model.solves()
+        .filter(duration_filter)
+        .filter(DojoChallenges.required == True)
+    )
+
+
+def scoreboard_query(model, duration):
+    return (
+        scoreboard_solves(model, duration)
+        .group_by(Solves.user_id)
+        .with_entities(Solves.user_id,
+                       db.func.count().label("solves"),
+                       db.func.max(Solves.id).label("last_solve_id"))
+    )
+
+
+def build_buckets(redis_client, model, prefix, days):
+    start = datetime.datetime.combine(min(days), datetime.time.min)
+    day = db.func.date_trunc("day", Solves.date).label("day")
+    results = (
+        scoreboard_solves(model, 0)
+        .filter(Solves.date >= start)
+        .group_by(Solves.user_id, day)
+        .with_entities(day,
+                       Solves.user_id,
+                       db.func.count().label("solves"),
+                       db.func.max(Solves.id).label("last_solve_id"))
+        .all()
+    )
+    day_results = {}
+    for result in results:
+        day_results.setdefault(result.day.date(), []).append(result)
+    last_solve_id = max((result.last_solve_id for result in results), default=0)
+
+    pipeline = redis_client.pipeline()
+    for bucket_day in days:
+        key = bucket_key(prefix, bucket_day)
+        expire_at = datetime.datetime.combine(bucket_day + datetime.timedelta(days=BUCKET_RETENTION_DAYS + 1),
+                                              datetime.time.min, tzinfo=datetime.timezone.utc)
+        pipeline.delete(f"{key}:solves", f"{key}:last")
+        for i in range(0, len(day_results.get(bucket_day, [])), 1000):
+            chunk = day_results[bucket_day][i:i+1000]
+            pipeline.zadd(f"{key}:solves", {result.user_id: result.solves for result in chunk})
+            pipeline.zadd(f"{key}:last", {result.user_id: result.last_solve_id for result in chunk})
+        pipeline.set(f"{key}:built", 1)
+        for suffix in ["solves", "last", "built"]:
+            pipeline.expireat(f"{key}:{suffix}", expire_at)
+    pipeline.execute()
+
+    # Solves committed while the buckets were being built would otherwise be missed
+    add_bucket_solve = redis_client.register_script(ADD_BUCKET_SOLVE_SCRIPT)
+    late_solves = (scoreboard_solves(model, 0)
+                   .filter(Solves.date >= start, Solves.id > last_solve_id)
+                   .with_entities(Solves.user_id, Solves.id, Solves.date)
+                   .order_by(Solves.id))
+    for user_id, solve_id, solve_date in late_solves:
+        if solve_date.date() in days:
+            key = bucket_key(prefix, solve_date.date())
+            add_bucket_solve(keys=[f"{key}:solves", f"{key}:last", f"{key}:built"], args=[user_id, solve_id])
+
+
+def build_windowed_scoreboard(redis_client, model, duration):
+    # The window is `duration` whole (UTC) days: today, which is partial, and the previous `duration - 1` days
+    prefix = model_prefix(redis_client, model)
+    key = f"scoreboard:{prefix}:{duration}"
+    now = datetime.datetime.utcnow()
+    days = [now.date() - datetime.timedelta(days=days_ago) for days_ago in range(duration)]
+
+    pipeline = redis_client.pipeline()
+    for day in days:
+        pipeline.exists(f"{bucket_key(prefix, day)}:built")
+    missing_days = [day for day, built in zip(days, pipeline.execute()) if not built]
+    if missing_days:
+        build_buckets(redis_client, model, prefix, missing_days)
+
+    # The board only changes when the window slides, or through incremental updates
+    until_midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time.min) - now
+    timeout = max(1, int(until_midnight.total_seconds())) if duration in SCOREBOARD_DURATIONS else WINDOWED_SCOREBOARD_TIMEOUT
+    timeout = min(timeout, SCOREBOARD_TIMEOUT)
+
+    compose_buckets = redis_client.register_script(COMPOSE_BUCKETS_SCRIPT)
+    compose_buckets(keys=[key, f"{key}:built", f"{key}:solves", f"{key}:last",
+                          *(f"{bucket_key(prefix, day)}:solves" for day in days),
+                          *(f"{bucket_key(prefix, day)}:last" for day in days)],
+                    args=[len(days), timeout])
+    return key
+
+
+def build_scoreboard(redis_client, model, duration):
+    if uses_buckets(duration):
+        return build_windowed_scoreboard(redis_client, model, duration)
+
+    key = scoreboard_key(redis_client, model, duration)
+    timeout = scoreboard_timeout(duration)
+    results = scoreboard_query(model, duration).all()
+    last_solve_id = max((result.last_solve_id for result in results), default=0)
+
+    pipeline = redis_client.pipeline()
+    pipeline.delete(f"{key}:building")
+    for i in range(0, len(results), 1000):
+        pipeline.zadd(f"{key}:building", {result.user_id: solve_score(result.solves, result.last_solve_id)
+                                          for result in results[i:i+1000]})
+    if results:
+        pipeline.rename(f"{key}:building", key)
+    else:
+        pipeline.delete(key)
+    pipeline.expire(key, timeout)
+    pipeline.set(f"{key}:built", 1, ex=timeout)
+    pipeline.execute()
+
+    # Solves committed while the board was being built would otherwise be missed
+    add_solve = redis_client.register_script(ADD_SOLVE_SCRIPT)
+    late_solves = (scoreboard_solves(model, duration)
+                   .filter(Solves.id > last_solve_id)
+                   .with_entities(Solves.user_id, Solves.id)
+                   .order_by(Solves.id))
+    for user_id, solve_id in late_solves:
+        add_solve(keys=[key, f"{key}:built"], args=[user_id, solve_id])
+    return key
+
+
+def get_scoreboard(model, duration, start, stop, user=None):
+    # Returns (total, standings, me) where standings are (rank, user_id, solves) for ranks start+1 through stop
+    redis_client = get_redis_client()
+    key = scoreboard_key(redis_client, model, duration)
+    if not redis_client.exists(f"{key}:built"):
+        key = build_scoreboard(redis_client, model, duration)
+
+    pipeline = redis_client.pipeline()
+    pipeline.zcard(key)
+    pipeline.zrevrange(key, start, stop - 1, withscores=True)
+    if user:
+        pipeline.zrevrank(key, user.id)
+        pipeline.zscore(key, user.id)
+    total, page, *me = pipeline.execute()
+
+    standings = [(start + index + 1, int(user_id), score_solves(score)) for index, (user_id, score) in enumerate(page)]
+    me = (me[0] + 1, user.id, score_solves(me[1])) if me and me[0] is not None else None
+    return total, standings, me
+
+
+def rebuild_scoreboards():
+    # Consistency rebuild: refresh every board that is in use before it expires
+    redis_client = get_redis_client()
+    rebuilt = set()
+    for marker in redis_client.scan_iter("scoreboard:*:built"):
+        _, _, _, dojo_id, module_index, duration, _ = marker.split(":")
+        if (dojo_id, module_index, duration) in rebuilt:
+            continue
+        duration = int(duration)
+        if uses_buckets(duration) or redis_client.ttl(marker) > scoreboard_timeout(duration) // 2:
+            continue
+        model = (Dojos.query.get(int(dojo_id)) if module_index == "_" else
+                 DojoModules.query.get((int(dojo_id), int(module_index))))
+        if model:
+            build_scoreboard(redis_client, model, duration)
+        rebuilt.add((dojo_id, module_index, str(duration)))
+    return len(rebuilt)
+
+
+def invalidate_scoreboards(dojo_id=None):
+    redis_client = get_redis_client()
+    redis_client.incr(f"scoreboard:generation:{dojo_id}" if dojo_id is not None else "scoreboard:generation")
+
+
+def apply_scoreboard_events(events):
+    redis_client = get_redis_client()
+    add_solve = redis_client.register_script(ADD_SOLVE_SCRIPT)
+    add_bucket_solve = redis_client.register_script(ADD_BUCKET_SOLVE_SCRIPT)
+    durations = sorted(SCOREBOARD_DURATIONS)
+    for event_type, *args in events:
+        if event_type == "invalidate":
+            invalidate_scoreboards(*args)
+            continue
+        solve_id, user_id, solve_day, dojo_id, module_indexes = args
+        for prefix in scoreboard_prefixes(redis_client, dojo_id, [None, *module_indexes]):
+            key = bucket_key(prefix, solve_day)
+            add_bucket_solve(keys=[f"{key}:solves", f"{key}:last", f"{key}:built"], args=[user_id, solve_id])
+            for duration in durations:
+                key = f"scoreboard:{prefix}:{duration}"
+                add_solve(keys=[key, f"{key}:built"], args=[user_id, solve_id])
+
+
+def queue_scoreboard_event(target, *event_args):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("scoreboard_events", []).append(event_args)
+
+
+@event.listens_for(Solves, "after_insert", propagate=True)
+def hook_solve_insert(mapper, connection, target):
+    boards = connection.execute(
+        DojoChallenges.solves()
+        .filter(Solves.id == target.id, DojoChallenges.required == True)
+        .with_entities(DojoChallenges.dojo_id, DojoChallenges.module_index)
+        .distinct()
+        .statement
+    ).all()
+    module_indexes = {}
+    for dojo_id, module_index in boards:
+        module_indexes.setdefault(dojo_id, []).append(module_index)
+    for dojo_id, indexes in module_indexes.items():
+        solve_day = (target.date or datetime.datetime.utcnow()).date()
+        queue_scoreboard_event(target, "solve", target.id, target.user_id, solve_day, dojo_id, tuple(indexes))
+
+
+@event.listens_for(Solves, "after_delete", propagate=True)
+def hook_solve_delete(mapper, connection, target):
+    queue_scoreboard_event(target, "invalidate")
+
+
+@event.listens_for(Users, "after_update", propagate=True)
+def hook_user_update(mapper, connection, target):
+    if inspect(target).attrs.hidden.history.has_changes():
+        queue_scoreboard_event(target, "invalidate")
+
+
+@event.listens_for(DojoUsers, "after_insert", propagate=True)
+@event.listens_for(DojoUsers, "after_delete", propagate=True)
+@event.listens_for(DojoModules, "after_insert", propagate=True)
+@event.listens_for(DojoModules, "after_delete", propagate=True)
+@event.listens_for(DojoChallenges, "after_insert", propagate=True)
+@event.listens_for(DojoChallenges, "after_delete", propagate=True)
+@event.listens_for(DojoChallengeVisibilities, "after_insert", propagate=True)
+@event.listens_for(DojoChallengeVisibilities, "after_delete", propagate=True)
+def hook_dojo_change(mapper, connection, target):
+    queue_scoreboard_event(target, "invalidate", target.dojo_id)
+
+
+@event.listens_for(Dojos, "after_update", propagate=True)
+@event.listens_for(DojoUsers, "after_update", propagate=True)
+@event.listens_for(DojoModules, "after_update", propagate=True)
+@event.listens_for(DojoChallenges, "after_update", propagate=True)
+@event.listens_for(DojoChallengeVisibilities, "after_update", propagate=True)
+def hook_dojo_update(mapper, connection, target):
+    # according to the docs, this is a necessary check to see if the
+    # target actually was modified (and thus an update was made)
+    if Session.object_session(target).is_modified(target, include_collections=False):
+        queue_scoreboard_event(target, "invalidate", target.dojo_id)
+
+
+@event.listens_for(Session, "after_commit")
+def hook_session_commit(session):
+    events = session.info.pop("scoreboard_events", None)
+    if events:
+        apply_scoreboard_events(list(dict.fromkeys(events)))
+
+
+@event.listens_for(Session, "after_rollback")
+def hook_session_rollback(session):
+    session.info.pop("scoreboard_events", None)
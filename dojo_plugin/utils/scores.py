@@ -1,11 +1,28 @@
+import datetime
+import logging
+
+import redis
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm.session import Session
 from sqlalchemy.sql import or_
 from CTFd.models import Solves, db
 from CTFd.cache import cache
-from ..models import Dojos, DojoChallenges
+from ..models import Dojos, DojoChallenges, DojoScores, DojoModuleScores
 from . import force_cache_updates
+from .redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+SCORED_DOJOS = or_(Dojos.data["type"].astext == "public", Dojos.official)
+SCORE_TABLES = [
+    (DojoScores, [DojoChallenges.dojo_id]),
+    (DojoModuleScores, [DojoChallenges.dojo_id, DojoChallenges.module_index]),
+]
+
 
 def scores_query(granularity, dojo_filter):
-    solve_count = db.func.count(Solves.id).label("solve_count")
+    solve_count = db.func.count(Solves.id).label("solves")
     last_solve_date = db.func.max(Solves.date).label("last_solve_date")
     fields = granularity + [ Solves.user_id, solve_count, last_solve_date ]
     grouping = granularity + [ Solves.user_id ]
@@ -13,43 +30,158 @@ def scores_query(granularity, dojo_filter):
     dsc_query = db.session.query(*fields).where(
         Dojos.dojo_id == DojoChallenges.dojo_id, DojoChallenges.challenge_id == Solves.challenge_id,
         dojo_filter
-    ).group_by(*grouping).order_by(Dojos.id, solve_count.desc(), last_solve_date)
+    ).group_by(*grouping)
 
-    return []
     return dsc_query
 
+
+def upsert_scores(model, source, columns):
+    statement = insert(model).from_select(columns, source)
+    return statement.on_conflict_do_update(
+        index_elements=[column for column in columns if column not in ("solves", "last_solve_date")],
+        set_=dict(solves=model.solves + statement.excluded.solves,
+                  last_solve_date=statement.excluded.last_solve_date),
+    )
+
+
+def mark_scores_stale(dojo_ids):
+    if dojo_ids:
+        get_redis_client().sadd("scores:stale", *dojo_ids)
+
+
+def refresh_scores(dojo_ids=None):
+    # Recount from Solves; dojo_ids=None recounts every dojo
+    dojo_filter = DojoChallenges.dojo_id.in_(dojo_ids) if dojo_ids is not None else db.true()
+    for model, granularity in SCORE_TABLES:
+        model.query.filter(model.dojo_id.in_(dojo_ids) if dojo_ids is not None else db.true()).delete(synchronize_session=False)
+        columns = [column.name for column in granularity] + ["user_id", "solves", "last_solve_date"]
+        source = scores_query(granularity, db.and_(SCORED_DOJOS, dojo_filter))
+        db.session.execute(insert(model).from_select(columns, source.statement))
+    db.session.commit()
+
+
+def refresh_stale_scores():
+    redis_client = get_redis_client()
+    if redis_client.set("scores:refreshed", 1, nx=True, ex=int(datetime.timedelta(days=1).total_seconds())):
+        redis_client.delete("scores:stale")
+        refresh_scores()
+        return None
+    stale = redis_client.spop("scores:stale", redis_client.scard("scores:stale") or 1) or []
+    dojo_ids = [int(dojo_id) for dojo_id in stale]
+    if dojo_ids:
+        refresh_scores(dojo_ids)
+    return dojo_ids
+
+
+def mark_ranks_stale(dojo_ids):
+    if dojo_ids:
+        get_redis_client().sadd("ranks:stale", *dojo_ids)
+
+
+def refresh_ranks(dojo_ids=None):
+    # Re-rank from the score tables; dojo_ids=None re-ranks every dojo
+    for model, granularity in SCORE_TABLES:
+        partition = [getattr(model, column.name) for column in granularity]
+        ranked = db.session.query(
+            *partition,
+            model.user_id,
+            db.func.row_number().over(partition_by=partition,
+                                      order_by=(model.solves.desc(), model.last_solve_date)).label("rank"),
+        ).filter(model.dojo_id.in_(dojo_ids) if dojo_ids is not None else db.true()).subquery()
+        db.session.execute(
+            db.update(model.__table__)
+            .where(*(getattr(model, column.name) == ranked.c[column.name] for column in granularity),
+                   model.user_id == ranked.c.user_id,
+                   model.rank.is_distinct_from(ranked.c.rank))
+            .values(rank=ranked.c.rank)
+        )
+    db.session.commit()
+    cache.delete_memoized(score_totals)
+
+
+def refresh_stale_ranks(dojo_ids=()):
+    # Re-ranks the dojos that gained solves since the last run, along with any dojo_ids whose scores were just recounted
+    redis_client = get_redis_client()
+    stale = redis_client.spop("ranks:stale", redis_client.scard("ranks:stale") or 1) or []
+    dojo_ids = sorted({*dojo_ids, *(int(dojo_id) for dojo_id in stale)})
+    if dojo_ids:
+        refresh_ranks(dojo_ids)
+    return dojo_ids
+
+
+@event.listens_for(Solves, "after_insert", propagate=True)
+def hook_solve_insert(mapper, connection, target):
+    solve_date = target.date or datetime.datetime.utcnow()
+    for model, granularity in SCORE_TABLES:
+        columns = [column.name for column in granularity] + ["user_id", "solves", "last_solve_date"]
+        source = (
+            db.session.query(*granularity,
+                             db.literal(target.user_id, db.Integer),
+                             db.func.count(),
+                             db.literal(solve_date, db.DateTime))
+            .join(Dojos, Dojos.dojo_id == DojoChallenges.dojo_id)
+            .filter(DojoChallenges.challenge_id == target.challenge_id, SCORED_DOJOS)
+            .group_by(*granularity)
+        )
+        dojo_ids = connection.execute(upsert_scores(model, source.statement, columns).returning(model.dojo_id)).scalars().all()
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault("scores_unranked", set()).update(dojo_ids)
+
+
+@event.listens_for(Solves, "after_delete", propagate=True)
+def hook_solve_delete(mapper, connection, target):
+    dojo_ids = connection.execute(
+        db.select(DojoChallenges.dojo_id).where(DojoChallenges.challenge_id == target.challenge_id).distinct()
+    ).scalars().all()
+    mark_scores_stale(dojo_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def hook_session_commit(session):
+    # Ranks are only stale once the solve is committed; a lost mark is repaired by the daily full refresh
+    dojo_ids = session.info.pop("scores_unranked", None)
+    if dojo_ids:
+        try:
+            mark_ranks_stale(dojo_ids)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to mark ranks stale for dojos {sorted(dojo_ids)}: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def hook_session_rollback(session):
+    session.info.pop("scores_unranked", None)
+
+
 @cache.memoize(timeout=1200, forced_update=force_cache_updates)
-def dojo_scores():
-    dsc_query = scores_query([Dojos.id], or_(Dojos.data["type"].astext == "public", Dojos.official))
+def score_totals():
+    dojo_users = dict(db.session.query(DojoScores.dojo_id, db.func.count()).group_by(DojoScores.dojo_id).all())
+    module_users = {}
+    for dojo_id, module_index, count in (db.session.query(DojoModuleScores.dojo_id, DojoModuleScores.module_index, db.func.count())
+                                         .group_by(DojoModuleScores.dojo_id, DojoModuleScores.module_index)):
+        module_users.setdefault(dojo_id, {})[module_index] = count
+    return dojo_users, module_users
 
-    user_ranks = { }
-    user_solves = { }
-    dojo_ranks = { }
-    for dojo_id, user_id, solve_count, _ in dsc_query:
-        dojo_ranks.setdefault(dojo_id, [ ]).append(user_id)
-        user_ranks.setdefault(user_id, {})[dojo_id] = len(dojo_ranks[dojo_id])
-        user_solves.setdefault(user_id, {})[dojo_id] = solve_count
 
+def dojo_scores(user):
+    dojo_users, _ = score_totals()
+    scores = DojoScores.query.filter_by(user_id=user.id).all()
     return {
-        "user_ranks": user_ranks,
-        "user_solves": user_solves,
-        "dojo_ranks": dojo_ranks
+        "user_ranks": {user.id: {score.dojo_id: score.rank for score in scores}},
+        "user_solves": {user.id: {score.dojo_id: score.solves for score in scores}},
+        "dojo_users": dojo_users,
     }
 
-@cache.memoize(timeout=1200, forced_update=force_cache_updates)
-def module_scores():
-    dsc_query = scores_query([Dojos.id, DojoChallenges.module_index], or_(Dojos.data["type"].astext == "public", Dojos.official))
 
+def module_scores(user):
+    _, module_users = score_totals()
     user_ranks = { }
     user_solves = { }
-    module_ranks = { }
-    for dojo_id, module_idx, user_id, solve_count, _ in dsc_query:
-        module_ranks.setdefault(dojo_id, {}).setdefault(module_idx, []).append(user_id)
-        user_ranks.setdefault(user_id, {}).setdefault(dojo_id, {})[module_idx] = len(module_ranks[dojo_id][module_idx])
-        user_solves.setdefault(user_id, {}).setdefault(dojo_id, {})[module_idx] = solve_count
-
+    for score in DojoModuleScores.query.filter_by(user_id=user.id):
+        user_ranks.setdefault(score.dojo_id, {})[score.module_index] = score.rank
+        user_solves.setdefault(score.dojo_id, {})[score.module_index] = score.solves
     return {
-        "user_ranks": user_ranks,
-        "user_solves": user_solves,
-        "module_ranks": module_ranks
+        "user_ranks": {user.id: user_ranks},
+        "user_solves": {user.id: user_solves},
+        "module_users": module_users,
     }
@@ -1,20 +1,70 @@
 from CTFd.cache import cache
-from CTFd.models import Solves
+from CTFd.models import Solves, db
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc
-
-from . import force_cache_updates, get_all_containers, DojoChallenges
+from sqlalchemy import event, func, desc, Date
+from sqlalchemy.dialects.postgresql import insert
+
+from . import force_cache_updates, DojoChallenges
+from ..models import DojoDailyStats
+from .redis_client import get_redis_client
+
+
+def refresh_daily_stats():
+    # Incremental updates can drift (deleted solves, visibility or dojo changes), so rebuild the rollup once a day
+    if not get_redis_client().set("dojo_daily_stats:refreshed", 1, nx=True, ex=int(timedelta(days=1).total_seconds())):
+        return False
+    solve_day = func.cast(Solves.date, Date)
+    daily_query = (
+        DojoChallenges.solves()
+        .with_entities(DojoChallenges.dojo_id, solve_day,
+                       func.count(Solves.id), func.count(func.distinct(Solves.user_id)))
+        .group_by(DojoChallenges.dojo_id, solve_day)
+    )
+    DojoDailyStats.query.delete(synchronize_session=False)
+    db.session.execute(insert(DojoDailyStats).from_select(["dojo_id", "day", "solves", "users"], daily_query.statement))
+    db.session.commit()
+    return True
+
+
+@event.listens_for(Solves, "after_insert", propagate=True)
+def hook_solve_daily_stats(mapper, connection, target):
+    solve_date = target.date or datetime.utcnow()
+    day_start = datetime.combine(solve_date.date(), datetime.min.time())
+
+    dojo_solves = connection.execute(
+        DojoChallenges.solves()
+        .filter(Solves.id == target.id)
+        .with_entities(DojoChallenges.dojo_id, func.count())
+        .group_by(DojoChallenges.dojo_id)
+        .statement
+    ).all()
+    if not dojo_solves:
+        return
+
+    seen_dojo_ids = set(connection.execute(
+        DojoChallenges.solves()
+        .filter(Solves.user_id == target.user_id, Solves.id != target.id,
+                Solves.date >= day_start, Solves.date < day_start + timedelta(days=1),
+                DojoChallenges.dojo_id.in_([dojo_id for dojo_id, _ in dojo_solves]))
+        .with_entities(DojoChallenges.dojo_id)
+        .distinct()
+        .statement
+    ).scalars())
+
+    statement = insert(DojoDailyStats).values([
+        dict(dojo_id=dojo_id, day=day_start.date(), solves=solves, users=int(dojo_id not in seen_dojo_ids))
+        for dojo_id, solves in dojo_solves
+    ])
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=["dojo_id", "day"],
+        set_=dict(solves=DojoDailyStats.solves + statement.excluded.solves,
+                  users=DojoDailyStats.users + statement.excluded.users),
+    ))
 
-@cache.memoize(timeout=1200, forced_update=force_cache_updates)
-def get_container_stats():
-    containers = get_all_containers()
-    return [{attr: container.labels[f"dojo.{attr}_id"]
-            for attr in ["dojo", "module", "challenge"]}
-            for container in containers]
 
 @cache.memoize(timeout=1200, forced_update=force_cache_updates)
 def get_dojo_stats(dojo):
-    now = datetime.now()
+    now = datetime.utcnow()
     solves_query = dojo.solves()
 
     total_challenges = len(dojo.challenges)
@@ -29,47 +79,17 @@ def get_dojo_stats(dojo):
     total_users = total_stats.total_users or 0
 
     # chart data
-    snapshot_days = [1, 7, 30, 60]
+    snapshot_days = [0, 7, 30, 60]
     chart_labels = ['Today', '1w ago', '1mo ago', '2mo ago']
-    chart_solves = []
-    chart_users = []
+    snapshot_dates = [(now - timedelta(days=days_ago)).date() for days_ago in snapshot_days]
 
-    return {
-        'users': total_users,
-        'challenges': total_challenges,
-        'visible_challenges': visible_challenges,
-        'solves': total_solves,
-        'recent_solves': [],
-        'trends': {
-            'solves': 0,
-            'users': 0,
-            'active': 0,
-            'challenges': 0,
-        },
-        'chart_data': {
-            'labels': chart_labels,
-            'solves': chart_solves,
-            'users': chart_users
-        }
+    daily_stats = {
+        stats.day: stats
+        for stats in DojoDailyStats.query.filter(DojoDailyStats.dojo_id == dojo.dojo_id,
+                                                 DojoDailyStats.day.in_(snapshot_dates))
     }
-
-    for days_ago in snapshot_days:
-        # get day given how many days ago
-        snapshot_date = now - timedelta(days=days_ago)
-        day_start = snapshot_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
-
-        # get day info
-        day_stats = solves_query.filter(
-            Solves.date >= day_start,
-            Solves.date < day_end
-        ).with_entities(
-            func.count(Solves.id).label('day_solves'),
-            func.count(func.distinct(Solves.user_id)).label('day_users')
-        ).first()
-
-        chart_solves.append(day_stats.day_solves or 0)
-        chart_users.append(day_stats.day_users or 0)
+    chart_solves = [daily_stats[day].solves if day in daily_stats else 0 for day in snapshot_dates]
+    chart_users = [daily_stats[day].users if day in daily_stats else 0 for day in snapshot_dates]
 
     # recent solves data
     basic_query = (
@@ -0,0 +1,82 @@
+import contextlib
+import hashlib
+import mmap
+import os
+import shutil
+import subprocess
+import tempfile
+
+from CTFd.cache import cache
+
+from ..config import DOJOS_DIR
+from . import resolved_tar, setuid_root_tarinfo
+
+
+TAR_CACHE_DIR = DOJOS_DIR / "tars"
+TAR_CACHE_VERSION = 2
+
+
+def dojo_commit(hex_dojo_id):
+    key = f"dojo-commit-{hex_dojo_id}"
+    if (commit := cache.get(key)) is not None:
+        return commit
+    result = subprocess.run(["git", "-C", str(DOJOS_DIR / hex_dojo_id), "rev-parse", "HEAD"], capture_output=True)
+    commit = result.stdout.decode().strip() if result.returncode == 0 else "spec"
+    cache.set(key, commit, timeout=0)
+    return commit
+
+
+def invalidate_tar_cache(dojo):
+    cache.delete(f"dojo-commit-{dojo.hex_dojo_id}")
+    shutil.rmtree(TAR_CACHE_DIR / dojo.hex_dojo_id, ignore_errors=True)
+
+
+def mapped_file(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextlib.contextmanager
+def challenge_tars(challenge_path, *, root_dir):
+    # Yields the challenge tar followed by one tar per option directory (in sorted order), closing them afterwards
+    tars = find_challenge_tars(challenge_path, root_dir=root_dir)
+    try:
+        yield tars
+    finally:
+        for tar in tars:
+            tar.close()
+
+
+def find_challenge_tars(challenge_path, *, root_dir):
+    option_paths = sorted(path for path in challenge_path.iterdir() if path.name.startswith("_") and path.is_dir())
+    option_names = {path.name for path in option_paths}
+
+    def build():
+        challenge_tar = resolved_tar(
+            challenge_path,
+            root_dir=root_dir,
+            filter=lambda path: path.relative_to(challenge_path).parts[0] not in option_names,
+            tarinfo_filter=setuid_root_tarinfo,
+        )
+        return [challenge_tar, *(resolved_tar(option_path, root_dir=root_dir, tarinfo_filter=setuid_root_tarinfo)
+                                 for option_path in option_paths)]
+
+    resolved_challenge_path = challenge_path.resolve()
+    if not resolved_challenge_path.is_relative_to(DOJOS_DIR.resolve()):
+        return build()
+    hex_dojo_id = resolved_challenge_path.relative_to(DOJOS_DIR.resolve()).parts[0]
+    if hex_dojo_id in ("tmp", TAR_CACHE_DIR.name):
+        return build()
+
+    cache_dir = TAR_CACHE_DIR / hex_dojo_id
+    digest = hashlib.sha256(f"{TAR_CACHE_VERSION}:{dojo_commit(hex_dojo_id)}:{resolved_challenge_path}".encode()).hexdigest()
+    tar_paths = [cache_dir / f"{digest}.tar", *(cache_dir / f"{digest}{option_path.name}.tar" for option_path in option_paths)]
+
+    if not all(tar_path.exists() for tar_path in tar_paths):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for tar_path, tar in zip(tar_paths, build()):
+            with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+                f.write(tar.getbuffer())
+            os.rename(f.name, tar_path)
+
+    return [mapped_file(tar_path) for tar_path in tar_paths]
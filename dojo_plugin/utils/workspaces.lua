@@ -0,0 +1,61 @@
+-- Running workspaces of one node: KEYS[1] maps container id -> workspace JSON, KEYS[2] holds the per-challenge counts,
+-- which are updated in the same script so adding or removing a workspace is idempotent. ARGV[1] names the operation,
+-- the remaining ARGV are its arguments. Loaded by dojo_plugin/utils/workspaces.py and, through a compose mount, by
+-- registry/registry.py.
+
+local function count_field(workspace)
+    local w = cjson.decode(workspace)
+    return w.dojo .. "/" .. w.module .. "/" .. w.challenge
+end
+
+local function count(workspace, increment)
+    local field = count_field(workspace)
+    if redis.call("HINCRBY", KEYS[2], field, increment) <= 0 then
+        redis.call("HDEL", KEYS[2], field)
+    end
+end
+
+-- add <container id> <workspace>
+local function add()
+    local old = redis.call("HGET", KEYS[1], ARGV[2])
+    redis.call("HSET", KEYS[1], ARGV[2], ARGV[3])
+    if old and count_field(old) == count_field(ARGV[3]) then
+        return 0
+    end
+    if old then
+        count(old, -1)
+    end
+    count(ARGV[3], 1)
+    return 1
+end
+
+-- remove <container id>
+local function remove()
+    local old = redis.call("HGET", KEYS[1], ARGV[2])
+    if not old then
+        return 0
+    end
+    redis.call("HDEL", KEYS[1], ARGV[2])
+    count(old, -1)
+    return 1
+end
+
+-- sync [<container id> <workspace>]...
+local function sync()
+    for _, old in ipairs(redis.call("HVALS", KEYS[1])) do
+        count(old, -1)
+    end
+    redis.call("DEL", KEYS[1])
+    for i = 2, #ARGV, 2 do
+        redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+        count(ARGV[i + 1], 1)
+    end
+    return 1
+end
+
+local operations = {add = add, remove = remove, sync = sync}
+local operation = operations[ARGV[1]]
+if not operation then
+    return redis.error_reply("unknown workspace operation " .. tostring(ARGV[1]))
+end
+return operation()
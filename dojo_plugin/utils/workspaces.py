@@ -0,0 +1,79 @@
+import collections
+import json
+import pathlib
+
+
+from ..config import WORKSPACE_NODES
+from . import get_all_containers
+from .redis_client import get_redis_client
+
+# Running workspaces as maintained by the registry service (registry/registry.py), which shares the workspace format
+# and the scripts in workspaces.lua. Until every node's table has a fresh heartbeat, fall back to listing the
+# containers on every node. workspaces:counts holds live per-challenge counts, updated in the same script as the
+# node's table, so adding or removing a workspace is idempotent whether the plugin or the registry sees it first.
+WORKSPACE_COUNTS_KEY = "workspaces:counts"
+
+WORKSPACES_SCRIPT = (pathlib.Path(__file__).parent / "workspaces.lua").read_text()
+
+
+def workspaces_key(node_id):
+    return f"workspaces:{node_id if node_id is not None else 'local'}"
+
+
+def container_workspace(container):
+    labels = container.labels
+    return dict(
+        id=container.id,
+        node=None,
+        user_id=int(labels["dojo.user_id"]),
+        as_user_id=int(labels.get("dojo.as_user_id", labels["dojo.user_id"])),
+        dojo=labels["dojo.dojo_id"],
+        module=labels["dojo.module_id"],
+        challenge=labels["dojo.challenge_id"],
+        mode=labels.get("dojo.mode"),
+        created=container.attrs["Created"],
+    )
+
+
+def workspace_keys():
+    return [workspaces_key(node_id) for node_id in WORKSPACE_NODES] or [workspaces_key(None)]
+
+
+def add_workspace(container, node_id):
+    workspace = dict(container_workspace(container), node=node_id)
+    get_redis_client().register_script(WORKSPACES_SCRIPT)(
+        keys=[workspaces_key(node_id), WORKSPACE_COUNTS_KEY], args=["add", container.id, json.dumps(workspace)])
+
+
+def remove_workspace(container, node_id):
+    get_redis_client().register_script(WORKSPACES_SCRIPT)(
+        keys=[workspaces_key(node_id), WORKSPACE_COUNTS_KEY], args=["remove", container.id])
+
+
+def get_workspace_counts():
+    pipeline = get_redis_client().pipeline()
+    for key in workspace_keys():
+        pipeline.exists(f"{key}:synced")
+    pipeline.hgetall(WORKSPACE_COUNTS_KEY)
+    *synced, counts = pipeline.execute()
+
+    if not all(synced):
+        return collections.Counter((workspace["dojo"], workspace["module"], workspace["challenge"])
+                                   for workspace in get_workspaces())
+    return collections.Counter({tuple(field.split("/")): int(count) for field, count in counts.items()})
+
+
+def get_workspaces(dojo=None):
+    pipeline = get_redis_client().pipeline()
+    for key in workspace_keys():
+        pipeline.exists(f"{key}:synced")
+        pipeline.hvals(key)
+    results = pipeline.execute()
+
+    if not all(results[0::2]):
+        return [container_workspace(container) for container in get_all_containers(dojo)]
+
+    workspaces = [json.loads(value) for values in results[1::2] for value in values]
+    if dojo:
+        workspaces = [workspace for workspace in workspaces if workspace["dojo"] == dojo.reference_id]
+    return workspaces
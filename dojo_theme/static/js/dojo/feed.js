@@ -1,6 +1,7 @@
 (function() {
     const MAX_EVENTS = 50;
     let eventSource = null;
+    let lastEventId = null;
     let reconnectAttempts = 0;
     const MAX_RECONNECT_ATTEMPTS = 10;
     const RECONNECT_DELAY = 3000;
@@ -377,7 +378,8 @@
         if (eventSource) eventSource.close();
         
         updateConnectionStatus('connecting', 'Connecting to live feed...');
-        eventSource = new EventSource('/pwncollege_api/v1/feed/stream');
+        const streamUrl = '/pwncollege_api/v1/feed/stream';
+        eventSource = new EventSource(lastEventId ? `${streamUrl}?last_event_id=${encodeURIComponent(lastEventId)}` : streamUrl);
         
         eventSource.onopen = () => {
             reconnectAttempts = 0;
@@ -386,6 +388,7 @@
         
         eventSource.onmessage = (event) => {
             try {
+                if (event.lastEventId) lastEventId = event.lastEventId;
                 const data = JSON.parse(event.data);
                 if (data.type === 'connected') {
                     updateConnectionStatus('connected', '');
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+import urllib.parse
+
+import redis.asyncio as redis
+
+# Standalone activity feed stream, served behind nginx at /pwncollege_api/v1/feed/stream.
+# Mirrors dojo_plugin/utils/feed_hub.py: keep the message format and resume semantics in sync.
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://cache:6379")
+FEED_MAX_EVENTS = int(os.environ.get("FEED_MAX_EVENTS", "1000"))
+FEED_CLIENT_QUEUE_SIZE = int(os.environ.get("FEED_CLIENT_QUEUE_SIZE", "64"))
+HEARTBEAT_INTERVAL = 30
+STREAM_PATH = "/pwncollege_api/v1/feed/stream"
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("feed")
+
+redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+clients = set()
+
+
+class Client(asyncio.Queue):
+    def __init__(self, dojo=None, user_id=None):
+        super().__init__(maxsize=FEED_CLIENT_QUEUE_SIZE)
+        self.dojo = dojo
+        self.user_id = user_id
+
+    @property
+    def filtered(self):
+        return self.dojo is not None or self.user_id is not None
+
+    def matches(self, event):
+        return ((self.dojo is None or event.get("data", {}).get("dojo_id") == self.dojo) and
+                (self.user_id is None or event.get("user_id") == self.user_id))
+
+
+def events_key(dojo=None, user_id=None):
+    if user_id is not None:
+        return f"activity_feed:events:user:{user_id}"
+    if dojo is not None:
+        return f"activity_feed:events:dojo:{dojo}"
+    return "activity_feed:events"
+
+
+def sse_message(data, event_id=None):
+    return ((f"id: {event_id}\n" if event_id is not None else "") + f"data: {data}\n\n").encode()
+
+
+async def subscribe():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe("activity_feed:live")
+            async for message in pubsub.listen():
+                score, event_json = message["data"].split(" ", 1)
+                item = (float(score), event_json)
+                event = json.loads(event_json) if any(client.filtered for client in clients) else None
+                for client in list(clients):
+                    if client.filtered and not client.matches(event):
+                        continue
+                    try:
+                        client.put_nowait(item)
+                    except asyncio.QueueFull:
+                        clients.discard(client)
+        except Exception as e:
+            logger.warning("Lost Redis subscription, resubscribing", exc_info=e)
+            await asyncio.sleep(1)
+
+
+async def read_request(reader):
+    request_line = (await reader.readline()).decode("latin-1").split()
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return request_line, headers
+
+
+async def stream(writer, last_event_id, dojo=None, user_id=None):
+    client = Client(dojo, user_id)
+    clients.add(client)
+    try:
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"X-Accel-Buffering: no\r\n"
+                     b"Connection: close\r\n\r\n")
+        writer.write(sse_message(json.dumps({"type": "connected"})))
+
+        last_score = None
+        try:
+            last_score = float(last_event_id) if last_event_id else None
+        except ValueError:
+            pass
+        if last_score is not None:
+            entries = await redis_client.zrangebyscore(events_key(dojo, user_id), f"({last_score!r}", "+inf",
+                                                       start=0, num=FEED_MAX_EVENTS, withscores=True)
+            bodies = await redis_client.mget([f"activity_feed:event:{event_id}" for event_id, _ in entries]) if entries else []
+            for (_, score), event_json in zip(entries, bodies):
+                if event_json is None or not client.matches(json.loads(event_json)):
+                    continue
+                writer.write(sse_message(event_json, repr(score)))
+                last_score = score
+        await writer.drain()
+
+        while client in clients:
+            try:
+                score, event_json = await asyncio.wait_for(client.get(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                writer.write(sse_message(json.dumps({"type": "heartbeat"})))
+                await writer.drain()
+                continue
+            if last_score is not None and score <= last_score:
+                continue
+            writer.write(sse_message(event_json, repr(score)))
+            await writer.drain()
+    finally:
+        clients.discard(client)
+
+
+async def handle(reader, writer):
+    try:
+        request_line, headers = await read_request(reader)
+        if len(request_line) < 2 or request_line[0] != "GET":
+            writer.write(b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return
+        url = urllib.parse.urlsplit(request_line[1])
+        if url.path.rstrip("/") != STREAM_PATH:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return
+        query = urllib.parse.parse_qs(url.query)
+        last_event_id = headers.get("last-event-id") or next(iter(query.get("last_event_id", [])), None)
+        dojo = next(iter(query.get("dojo", [])), None)
+        user_id = next(iter(query.get("user", [])), None)
+        await stream(writer, last_event_id, dojo, int(user_id) if user_id and user_id.isdigit() else None)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main():
+    server = await asyncio.start_server(handle, "0.0.0.0", int(os.environ.get("PORT", "8080")))
+    logger.info(f"Serving the activity feed on {server.sockets[0].getsockname()}")
+    async with server:
+        await asyncio.gather(subscribe(), server.serve_forever())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
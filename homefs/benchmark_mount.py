@@ -0,0 +1,60 @@
+import argparse
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+# Mounts many volumes at once through the volume driver API, like Docker does when a node boots, e.g.:
+#   python benchmark_mount.py --url http://localhost:4201 --volumes 500
+
+
+def driver_call(url, method, **data):
+    response = requests.post(f"{url}/VolumeDriver.{method}", json=data, timeout=600)
+    response.raise_for_status()
+    if err := response.json().get("Err"):
+        raise RuntimeError(f"{method} failed: {err}")
+    return response.json()
+
+
+def mount(url, name):
+    start = time.monotonic()
+    driver_call(url, "Mount", Name=name, ID=str(uuid.uuid4()))
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:4201")
+    parser.add_argument("--volumes", type=int, default=500)
+    parser.add_argument("--mounts-per-volume", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--overlay", action="store_true", help="mount read-only overlays of one shared volume")
+    args = parser.parse_args()
+
+    prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+    names = [f"{prefix}-{i}" for i in range(args.volumes)]
+    for name in names:
+        driver_call(args.url, "Create", Name=name, Opts={"overlay": f"{prefix}-shared"} if args.overlay else {})
+
+    try:
+        start = time.monotonic()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            latencies = list(executor.map(lambda name: mount(args.url, name), names * args.mounts_per_volume))
+        elapsed = time.monotonic() - start
+    finally:
+        for name in names:
+            driver_call(args.url, "Remove", Name=name)
+
+    latencies.sort()
+    print(f"{len(latencies)} mounts in {elapsed:.2f}s ({len(latencies) / elapsed:.1f}/s)")
+    print(f"latency: mean {statistics.mean(latencies):.3f}s, "
+          f"p50 {latencies[len(latencies) // 2]:.3f}s, "
+          f"p99 {latencies[int(len(latencies) * 0.99)]:.3f}s, "
+          f"max {latencies[-1]:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
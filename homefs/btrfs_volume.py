@@ -1,19 +1,28 @@
-import io
 import os
 import re
 import subprocess
 import sys
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
 from pathlib import Path
 
 import requests
+from sqlalchemy.exc import IntegrityError
 
-from utils import file_lock
+from utils import file_lock, increment_counter, read_counters
 
 
 STORAGE_ROOT = Path(os.environ.get("STORAGE_ROOT", "/data"))
 VOLUME_SIZE = os.environ.get("VOLUME_SIZE", "1G")
+# Set to "zstd" to ask peers to compress the snapshots they send us
+SEND_COMPRESSION = os.environ.get("SEND_COMPRESSION", "")
+COMPRESSION_HEADER = "X-Btrfs-Compression"
+# Fetchers advertise their newest snapshots, and the sender replies with the common parent it diffed against
+PARENTS_HEADER = "X-Btrfs-Parents"
+PARENT_HEADER = "X-Btrfs-Parent"
+MAX_ADVERTISED_PARENTS = 16
+# Streams move through pipes one chunk at a time, so a slow reader blocks the writer instead of buffering
+CHUNK_SIZE = 1 << 20
 
 
 def btrfs(*args, **kwargs):
@@ -21,6 +30,23 @@ def btrfs(*args, **kwargs):
     return subprocess.run(["btrfs", *args], **kwargs)
 
 
+def subvolume_generation(path):
+    output = btrfs("subvolume", "show", path, capture_output=True, text=True).stdout
+    return int(re.search(r"^\s*Generation:\s*(\d+)", output, re.MULTILINE)[1])
+
+
+def metrics_path():
+    return STORAGE_ROOT / ".metrics"
+
+
+def metrics():
+    return "".join(f"homefs_{name}_total {value}\n" for name, value in read_counters(metrics_path()).items())
+
+
+def pipe_chunks(file):
+    return iter(lambda: file.read(CHUNK_SIZE), b"")
+
+
 def check_volume_storage():
     mounts = Path("/proc/mounts").read_text().splitlines()
     for mount in reversed(mounts):
@@ -39,8 +65,9 @@ class BTRFSVolume:
     def __init__(self, name):
         self.name = name
         for path in (self.path, self.snapshots_path, self.overlays_path):
-            if not path.exists():
-                btrfs("subvolume", "create", path)
+            # Concurrent requests for a new volume may race to create it
+            if not path.exists() and btrfs("subvolume", "create", path, check=False).returncode != 0 and not path.exists():
+                raise RuntimeError(f"Failed to create subvolume {path}")
 
 
     @contextmanager
@@ -48,6 +75,11 @@ class BTRFSVolume:
         with file_lock(self.path / ".active.lock", blocking=blocking):
             yield
 
+    @contextmanager
+    def fetch_lock(self):
+        with file_lock(self.path / ".fetch.lock"):
+            yield
+
     def activate(self, host, *, locked=False):
         if not locked:
             with self.active_lock():
@@ -85,12 +117,23 @@ class BTRFSVolume:
         snapshot_path = self.snapshots_path / now_id
 
         def active_snapshot():
+            # The active subvolume's generation only moves when it is written to, so an unchanged generation since
+            # our last snapshot means that snapshot is still current; sync first so pending writes are counted
             prev_snapshot_path = self.latest_snapshot_path
-            btrfs("subvolume", "snapshot", "-r", self.active_path, snapshot_path)
-            diff = self.diff(prev_snapshot_path, snapshot_path)
-            if len(diff) == 1:
-                btrfs("subvolume", "delete", snapshot_path)
+            btrfs("filesystem", "sync", self.active_path)
+            generation = subvolume_generation(self.active_path)
+            if prev_snapshot_path and self.snapshot_generation == (prev_snapshot_path.name, generation):
+                increment_counter(metrics_path() / "snapshots_redundant")
                 return prev_snapshot_path
+            btrfs("subvolume", "snapshot", "-r", self.active_path, snapshot_path)
+            self.latest_snapshot_path = snapshot_path
+            # Snapshotting bumps the source's generation to the snapshot's own; anything beyond that is a write that
+            # landed after the snapshot, so keep the generation read before it and let the next snapshot see the change
+            snapshot_generation = subvolume_generation(self.active_path)
+            if snapshot_generation <= subvolume_generation(snapshot_path):
+                generation = snapshot_generation
+            self.snapshot_generation = (snapshot_path.name, generation)
+            increment_counter(metrics_path() / "snapshots_created")
             return snapshot_path
 
         if self.active:
@@ -105,6 +148,7 @@ class BTRFSVolume:
         if not self.latest_snapshot_path:
             btrfs("subvolume", "create", snapshot_path)
             btrfs("property", "set", snapshot_path, "ro", "true")
+            self.latest_snapshot_path = snapshot_path
 
         return self.latest_snapshot_path
 
@@ -121,53 +165,127 @@ class BTRFSVolume:
             return
         btrfs("subvolume", "delete", overlay_path)
 
-    def diff(self, snapshot_a, snapshot_b):
-        stream_process = subprocess.Popen(["btrfs", "send", "--no-data", "-p", snapshot_a, snapshot_b],
-                                          stdout=subprocess.PIPE)
-        try:
-            return subprocess.check_output(["btrfs", "receive", "--dump"],
-                                           stdin=stream_process.stdout,
-                                           text=True).strip().splitlines()
-        finally:
-            stream_process.wait()
-
-    def send(self, snapshot_path=None, incremental_from=None):
+    def send(self, snapshot_path=None, incremental_from=None, compression=None):
         snapshot_path = snapshot_path or self.snapshot()
         btrfs_send_args = ["btrfs", "send"]
         if incremental_from and (incremental_from_path := self.snapshots_path / incremental_from).exists():
             btrfs_send_args.extend(["-p", incremental_from_path])
         btrfs_send_args.append(snapshot_path)
-        return subprocess.check_output(btrfs_send_args)
 
-    def receive(self, stream):
+        def stream():
+            # Hold the snapshots being sent, so garbage collection leaves them alone until the send finishes. All of
+            # this happens on first iteration, so a response that is closed before it starts leaks no processes.
+            with ExitStack() as locks:
+                for name in {snapshot_path.name, incremental_from} - {None}:
+                    locks.enter_context(self.snapshot_lock(name, shared=True))
+                processes = [subprocess.Popen(btrfs_send_args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)]
+                if compression == "zstd":
+                    processes.append(subprocess.Popen(["zstd", "-q", "-c"], stdin=processes[0].stdout, stdout=subprocess.PIPE))
+                    processes[0].stdout.close()
+                try:
+                    yield from pipe_chunks(processes[-1].stdout)
+                    for process in processes:
+                        if process.wait() != 0:
+                            # Abort the response, so the receiver sees a truncated stream rather than a complete one
+                            raise RuntimeError(f"Failed to send snapshot {snapshot_path}: {process.args[0]} exited with {process.returncode}")
+                finally:
+                    for process in processes:
+                        if process.poll() is None:
+                            process.kill()
+                        process.wait()
+                    processes[-1].stdout.close()
+
+        return stream()
+
+    def receive(self, chunks, compression=None):
         receive_process = subprocess.Popen(["btrfs", "receive", str(self.snapshots_path)],
                                            stdin=subprocess.PIPE,
-                                           stdout=subprocess.PIPE,
+                                           stdout=subprocess.DEVNULL,
                                            stderr=subprocess.PIPE)
-        while True:
-            chunk = stream.read(0x1000)
-            if not chunk:
-                break
-            receive_process.stdin.write(chunk)
-        stdout, stderr = receive_process.communicate()
-        if receive_process.returncode != 0:
-            raise RuntimeError(stderr.decode())
-        if match := re.match(r"At subvol (?P<subvol>\S+)", stderr.decode()):
-            return self.snapshots_path / match["subvol"]
-
-    def fetch(self, host):
+        processes = [receive_process]
+        if compression == "zstd":
+            processes.insert(0, subprocess.Popen(["zstd", "-q", "-d", "-c"], stdin=subprocess.PIPE, stdout=receive_process.stdin))
+            receive_process.stdin.close()
+
+        try:
+            for chunk in chunks:
+                processes[0].stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            processes[0].stdin.close()
+        stderr = receive_process.stderr.read().decode()
+        for process in processes:
+            process.wait()
+        match = re.match(r"At (?:subvol|snapshot) (?P<subvol>\S+)", stderr)
+        if any(process.returncode != 0 for process in processes):
+            # Do not leave a partially received snapshot behind, it would be mistaken for a complete one
+            if match and (self.snapshots_path / match["subvol"]).exists():
+                btrfs("subvolume", "delete", self.snapshots_path / match["subvol"], check=False)
+            raise RuntimeError(stderr or "Failed to receive snapshot")
+        if match:
+            snapshot_path = self.snapshots_path / match["subvol"]
+            self.latest_snapshot_path = snapshot_path
+            return snapshot_path
+
+    def fetch(self, host, *, incremental=True, locked=False):
+        # Concurrent fetches of a volume wait for the first one, and then find its snapshot current
+        if not locked:
+            with self.fetch_lock():
+                return self.fetch(host, incremental=incremental, locked=True)
+
+        from models import db
+
         headers = {}
-        if self.latest_snapshot_path:
-            headers["If-None-Match"] = self.latest_snapshot_path.name
-        response = requests.get(f"http://{host}:4201/volume/{self.name}", headers=headers)
-        etag_path = self.snapshots_path / response.headers["ETag"]
-        if response.status_code == 304 or etag_path.exists():
-            # We already have the latest snapshot (we may have requested the volume from ourselves)
-            return etag_path
-        elif response.status_code == 200:
-            return self.receive(io.BytesIO(response.content))
-        else:
-            raise RuntimeError(f"Failed to get snapshot: {response.status_code}")
+        if latest_snapshot_path := self.latest_snapshot_path:
+            headers["If-None-Match"] = latest_snapshot_path.name
+        if incremental and (snapshot_names := self.snapshot_names):
+            headers[PARENTS_HEADER] = ",".join(snapshot_names[-MAX_ADVERTISED_PARENTS:])
+        if SEND_COMPRESSION:
+            headers[COMPRESSION_HEADER] = SEND_COMPRESSION
+        # Do not hold a database transaction open across the transfer; receive commits the new snapshot on its own
+        db.session.close()
+        with requests.get(f"http://{host}:4201/volume/{self.name}", headers=headers, stream=True) as response:
+            etag_path = self.snapshots_path / response.headers["ETag"]
+            if response.status_code == 304 or etag_path.exists():
+                # We already have the latest snapshot (we may have requested the volume from ourselves)
+                return etag_path
+            elif response.status_code == 200:
+                try:
+                    return self.receive(response.iter_content(CHUNK_SIZE), compression=response.headers.get(COMPRESSION_HEADER))
+                except RuntimeError:
+                    if not response.headers.get(PARENT_HEADER):
+                        raise
+            else:
+                raise RuntimeError(f"Failed to get snapshot: {response.status_code}")
+        # Our copy of the parent could not be used (e.g. it was received from elsewhere), fall back to a full send
+        return self.fetch(host, incremental=False, locked=True)
+
+    @contextmanager
+    def snapshot_lock(self, snapshot_name, *, blocking=True, shared=False):
+        locks_path = self.path / ".snapshot-locks"
+        locks_path.mkdir(exist_ok=True)
+        with file_lock(locks_path / snapshot_name, blocking=blocking, shared=shared):
+            yield locks_path / snapshot_name
+
+    def prune_snapshots(self, keep):
+        pruned = []
+        for snapshot_name in self.snapshot_names:
+            if snapshot_name in keep:
+                continue
+            try:
+                with self.snapshot_lock(snapshot_name, blocking=False) as lock_path:
+                    btrfs("subvolume", "delete", self.snapshots_path / snapshot_name)
+                    lock_path.unlink()
+            except BlockingIOError:
+                continue
+            pruned.append(snapshot_name)
+        return pruned
+
+    def common_parent(self, snapshot_names, snapshot_path):
+        local_names = set(self.snapshot_names)
+        parents = [name for name in snapshot_names if name in local_names and name < snapshot_path.name]
+        return max(parents, default=None)
 
     @property
     def path(self):
@@ -190,8 +308,47 @@ class BTRFSVolume:
         return self.path / "overlays"
 
     @property
-    def latest_snapshot_path(self):
+    def snapshot_generation(self):
         try:
-            return next(reversed(sorted(self.snapshots_path.iterdir())))
-        except StopIteration:
+            snapshot_name, generation = (self.path / ".generation").read_text().split()
+            return snapshot_name, int(generation)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @snapshot_generation.setter
+    def snapshot_generation(self, value):
+        (self.path / ".generation").write_text(" ".join(map(str, value)))
+
+    @property
+    def snapshot_names(self):
+        return sorted(path.name for path in self.snapshots_path.iterdir())
+
+    @property
+    def latest_snapshot_path(self):
+        from models import LatestSnapshots
+
+        latest_snapshot = LatestSnapshots.query.filter_by(name=self.name).first()
+        if latest_snapshot and (snapshot_path := self.snapshots_path / latest_snapshot.snapshot).exists():
+            return snapshot_path
+        snapshot_names = self.snapshot_names
+        if not snapshot_names:
             return None
+        self.latest_snapshot_path = self.snapshots_path / snapshot_names[-1]
+        return self.snapshots_path / snapshot_names[-1]
+
+    @latest_snapshot_path.setter
+    def latest_snapshot_path(self, snapshot_path):
+        from models import LatestSnapshots, db
+
+        latest_snapshot = LatestSnapshots.query.filter_by(name=self.name).first()
+        if not latest_snapshot:
+            latest_snapshot = LatestSnapshots(name=self.name)
+            db.session.add(latest_snapshot)
+        elif (latest_snapshot.snapshot >= snapshot_path.name and
+              (self.snapshots_path / latest_snapshot.snapshot).exists()):
+            return
+        latest_snapshot.snapshot = snapshot_path.name
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
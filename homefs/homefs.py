@@ -2,13 +2,15 @@ import logging
 import os
 from pathlib import Path
 
-from flask import Flask
+from flask import Flask, Response
+from sqlalchemy import event
 from werkzeug.routing import BaseConverter
 
-from models import db
-from btrfs_volume import check_volume_storage, BTRFSVolume
+from models import configure_sqlite, db
+from btrfs_volume import check_volume_storage, metrics, BTRFSVolume
 from volume_server import volume_server
 from volume_driver import volume_driver
+from retention import start_garbage_collector
 from utils import file_lock
 
 
@@ -31,16 +33,19 @@ def create_app():
 
     homefs_db_path= STORAGE_ROOT / "homefs.db"
     app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{homefs_db_path}"
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": {"timeout": 30}}
 
     db.init_app(app)
 
     with app.app_context():
+        event.listen(db.engine, "connect", configure_sqlite)
         db.create_all()
 
     app.url_map.converters["volume"] = VolumeConverter
 
     app.register_blueprint(volume_driver, url_prefix="/")
     app.register_blueprint(volume_server, url_prefix="/volume")
+    app.add_url_rule("/metrics", view_func=lambda: Response(metrics(), mimetype="text/plain"))
 
     root = logging.getLogger()
     if not root.handlers:
@@ -50,4 +55,6 @@ def create_app():
         root.addHandler(handler)
         root.setLevel(logging.INFO)
 
+    start_garbage_collector(app)
+
     return app
@@ -6,12 +6,26 @@ from btrfs_volume import BTRFSVolume
 db = SQLAlchemy()
 
 
+def configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers proceed while a writer commits, and mass mounts are mostly reads
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 class ActiveVolumes(db.Model):
     name = db.Column(db.String, primary_key=True)
     host = db.Column(db.String)
     created = db.Column(db.DateTime, server_default=db.func.now())
 
 
+class LatestSnapshots(db.Model):
+    __tablename__ = "latest_snapshots"
+    name = db.Column(db.String, primary_key=True)
+    snapshot = db.Column(db.String)
+
+
 class DockerVolumes(db.Model):
     __tablename__ = "docker_volumes"
     name = db.Column(db.String, primary_key=True)
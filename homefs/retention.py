@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import btrfs_volume
+from btrfs_volume import BTRFSVolume
+from utils import file_lock, increment_counter
+
+
+SNAPSHOT_KEEP_HOURLY = int(os.environ.get("SNAPSHOT_KEEP_HOURLY", "24"))
+SNAPSHOT_KEEP_DAILY = int(os.environ.get("SNAPSHOT_KEEP_DAILY", "7"))
+SNAPSHOT_KEEP_WEEKLY = int(os.environ.get("SNAPSHOT_KEEP_WEEKLY", "4"))
+SNAPSHOT_MAX_COUNT = int(os.environ.get("SNAPSHOT_MAX_COUNT", "32"))
+SNAPSHOT_GC_INTERVAL = int(os.environ.get("SNAPSHOT_GC_INTERVAL", "3600"))
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_date(snapshot_name):
+    try:
+        return datetime.strptime(snapshot_name, "%Y%m%d-%H%M%S-%f")
+    except ValueError:
+        return None
+
+
+def retained_snapshots(snapshot_names):
+    # Keep the newest snapshot of each of the last N hours, days and ISO weeks, capped at the newest SNAPSHOT_MAX_COUNT
+    snapshot_names = sorted(snapshot_names, reverse=True)
+    dated = [(snapshot_date(name), name) for name in snapshot_names]
+    keep = {name for date, name in dated if date is None}
+    keep.update(snapshot_names[:1])
+    for count, period in ((SNAPSHOT_KEEP_HOURLY, "%Y%m%d%H"), (SNAPSHOT_KEEP_DAILY, "%Y%m%d"), (SNAPSHOT_KEEP_WEEKLY, "%G%V")):
+        periods = set()
+        for date, name in dated:
+            if date is None:
+                continue
+            if len(periods) >= count:
+                break
+            if date.strftime(period) not in periods:
+                periods.add(date.strftime(period))
+                keep.add(name)
+    return set(sorted(keep, reverse=True)[:max(SNAPSHOT_MAX_COUNT, 1)])
+
+
+def collect_garbage():
+    pruned = 0
+    for path in sorted(btrfs_volume.STORAGE_ROOT.iterdir()):
+        if path.name.startswith(".") or not (path / "snapshots").is_dir():
+            continue
+        volume = BTRFSVolume(path.name)
+        keep = retained_snapshots(volume.snapshot_names)
+        if volume.latest_snapshot_path:
+            keep.add(volume.latest_snapshot_path.name)
+        for _ in volume.prune_snapshots(keep):
+            increment_counter(btrfs_volume.metrics_path() / "snapshots_pruned")
+            pruned += 1
+    return pruned
+
+
+def run_garbage_collector(app):
+    # Every gunicorn worker runs this loop; the lock and the last-run stamp make only one of them collect per interval
+    gc_path = btrfs_volume.STORAGE_ROOT / ".gc"
+    while True:
+        time.sleep(SNAPSHOT_GC_INTERVAL)
+        try:
+            with file_lock(gc_path.with_suffix(".lock"), blocking=False):
+                if gc_path.exists() and time.time() - gc_path.stat().st_mtime < SNAPSHOT_GC_INTERVAL:
+                    continue
+                gc_path.touch()
+                with app.app_context():
+                    pruned = collect_garbage()
+                logger.info(f"Pruned {pruned} snapshots")
+        except BlockingIOError:
+            continue
+        except Exception as e:
+            logger.exception(f"Snapshot garbage collection failed: {e}")
+
+
+def start_garbage_collector(app):
+    if SNAPSHOT_GC_INTERVAL > 0:
+        threading.Thread(target=run_garbage_collector, args=(app,), name="snapshot-gc", daemon=True).start()
@@ -0,0 +1,186 @@
+import os
+import shutil
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+import btrfs_volume
+import retention
+from btrfs_volume import BTRFSVolume, btrfs
+from models import db
+
+
+@pytest.fixture
+def storage(tmp_path):
+    if os.geteuid() != 0 or not shutil.which("mkfs.btrfs"):
+        pytest.skip("requires root and btrfs-progs for a loopback btrfs image")
+    image_path = tmp_path / "btrfs.img"
+    mount_path = tmp_path / "mnt"
+    mount_path.mkdir()
+    with open(image_path, "wb") as f:
+        f.truncate(256 << 20)
+    subprocess.run(["mkfs.btrfs", "-q", image_path], check=True)
+    subprocess.run(["mount", "-o", "loop", image_path, mount_path], check=True)
+    try:
+        for node in ("a", "b"):
+            (mount_path / node).mkdir()
+        yield mount_path
+    finally:
+        subprocess.run(["umount", mount_path], check=True)
+
+
+@pytest.fixture
+def app(storage):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{storage / 'homefs.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture
+def node(storage, app, monkeypatch):
+    def node(name):
+        monkeypatch.setattr(btrfs_volume, "STORAGE_ROOT", storage / name)
+        return BTRFSVolume("home")
+    return node
+
+
+def write_home(volume, filename, size):
+    if not volume.active:
+        btrfs("subvolume", "snapshot", volume.snapshot(), volume.active_path)
+    (volume.active_path / filename).write_bytes(os.urandom(size))
+    return volume.snapshot()
+
+
+def transfer(node, source, destination, *, parents=None):
+    volume = node(source)
+    snapshot_path = volume.latest_snapshot_path
+    parent = volume.common_parent(parents, snapshot_path) if parents is not None else None
+    chunks = list(volume.send(snapshot_path, incremental_from=parent))
+    received_path = node(destination).receive(chunks)
+    return received_path, parent, sum(len(chunk) for chunk in chunks)
+
+
+def test_incremental_send(node):
+    first_snapshot_path = write_home(node("a"), "big", 4 << 20)
+    received_path, parent, full_size = transfer(node, "a", "b")
+    assert parent is None
+    assert received_path.name == first_snapshot_path.name
+
+    snapshot_path = write_home(node("a"), "small", 4 << 10)
+    received_path, parent, incremental_size = transfer(node, "a", "b", parents=node("b").snapshot_names)
+    assert parent == first_snapshot_path.name
+    assert received_path.name == snapshot_path.name
+    assert (received_path / "big").stat().st_size == 4 << 20
+    assert (received_path / "small").stat().st_size == 4 << 10
+    assert incremental_size < full_size / 4
+
+
+def test_incremental_send_back(node):
+    write_home(node("a"), "big", 1 << 20)
+    transfer(node, "a", "b")
+    snapshot_path = write_home(node("b"), "more", 4 << 10)
+
+    # b only holds a received copy of the parent, which must still be usable in the other direction
+    received_path, parent, _ = transfer(node, "b", "a", parents=node("a").snapshot_names)
+    assert parent is not None
+    assert received_path.name == snapshot_path.name
+    assert (received_path / "more").exists()
+
+
+def test_missing_parent_falls_back(node):
+    write_home(node("a"), "big", 1 << 20)
+    transfer(node, "a", "b")
+    write_home(node("a"), "small", 4 << 10)
+
+    volume = node("a")
+    snapshot_path = volume.latest_snapshot_path
+    parent = volume.common_parent(node("b").snapshot_names, snapshot_path)
+    chunks = list(node("a").send(snapshot_path, incremental_from=parent))
+
+    volume = node("b")
+    btrfs("subvolume", "delete", volume.snapshots_path / parent)
+    with pytest.raises(RuntimeError):
+        volume.receive(chunks)
+    assert volume.snapshot_names == []
+
+    assert node("a").common_parent(node("b").snapshot_names, snapshot_path) is None
+    received_path, parent, _ = transfer(node, "a", "b", parents=node("b").snapshot_names)
+    assert parent is None
+    assert (received_path / "small").exists()
+
+
+def test_redundant_snapshot(node):
+    volume = node("a")
+    snapshot_path = write_home(volume, "file", 4 << 10)
+    assert volume.snapshot() == snapshot_path
+    assert "homefs_snapshots_redundant_total 1\n" in btrfs_volume.metrics()
+
+    (volume.active_path / "file").write_bytes(b"changed")
+    assert volume.snapshot() != snapshot_path
+    assert "homefs_snapshots_created_total 2\n" in btrfs_volume.metrics()
+
+
+def test_write_during_snapshot(node, monkeypatch):
+    volume = node("a")
+    write_home(volume, "file", 4 << 10)
+    (volume.active_path / "file").write_bytes(b"changed")
+
+    def btrfs_then_write(*args, **kwargs):
+        result = btrfs(*args, **kwargs)
+        if args[:2] == ("subvolume", "snapshot"):
+            (volume.active_path / "file").write_bytes(b"written after the snapshot")
+            btrfs("filesystem", "sync", volume.active_path)
+        return result
+
+    monkeypatch.setattr(btrfs_volume, "btrfs", btrfs_then_write)
+    snapshot_path = volume.snapshot()
+    monkeypatch.setattr(btrfs_volume, "btrfs", btrfs)
+    assert (snapshot_path / "file").read_bytes() == b"changed"
+
+    latest_snapshot_path = volume.snapshot()
+    assert latest_snapshot_path != snapshot_path
+    assert (latest_snapshot_path / "file").read_bytes() == b"written after the snapshot"
+
+
+def snapshot_names(*dates):
+    return [date.strftime("%Y%m%d-%H%M%S-%f") for date in dates]
+
+
+def test_retained_snapshots(monkeypatch):
+    monkeypatch.setattr(retention, "SNAPSHOT_KEEP_HOURLY", 2)
+    monkeypatch.setattr(retention, "SNAPSHOT_KEEP_DAILY", 2)
+    monkeypatch.setattr(retention, "SNAPSHOT_KEEP_WEEKLY", 0)
+    monkeypatch.setattr(retention, "SNAPSHOT_MAX_COUNT", 3)
+
+    now = datetime(2024, 6, 5, 12, 30)
+    latest, same_hour, last_hour, yesterday, last_week = snapshot_names(
+        now, now - timedelta(minutes=10), now - timedelta(hours=1), now - timedelta(days=1), now - timedelta(days=7))
+    names = [latest, same_hour, last_hour, yesterday, last_week]
+    assert retention.retained_snapshots(names) == {latest, last_hour, yesterday}
+
+    monkeypatch.setattr(retention, "SNAPSHOT_MAX_COUNT", 2)
+    assert retention.retained_snapshots(names) == {latest, last_hour}
+
+
+def test_collect_garbage(node, monkeypatch):
+    monkeypatch.setattr(retention, "SNAPSHOT_MAX_COUNT", 1)
+    volume = node("a")
+    write_home(volume, "one", 4 << 10)
+    sending_path = write_home(volume, "two", 4 << 10)
+    latest_path = write_home(volume, "three", 4 << 10)
+
+    stream = volume.send(sending_path)
+    next(stream)
+    retention.collect_garbage()
+    assert volume.snapshot_names == [sending_path.name, latest_path.name]
+    assert volume.latest_snapshot_path == latest_path
+
+    stream.close()
+    retention.collect_garbage()
+    assert volume.snapshot_names == [latest_path.name]
+    assert "homefs_snapshots_pruned_total 3\n" in btrfs_volume.metrics()
@@ -4,12 +4,25 @@ from contextlib import contextmanager
 
 
 @contextmanager
-def file_lock(path, *, blocking=True):
+def file_lock(path, *, blocking=True, shared=False):
     lock_fd = os.open(path, os.O_CREAT | os.O_RDWR)
     try:
-        yield fcntl.flock(lock_fd, fcntl.LOCK_EX | (fcntl.LOCK_NB if not blocking else 0))
+        yield fcntl.flock(lock_fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (fcntl.LOCK_NB if not blocking else 0))
     except BlockingIOError:
         raise
     finally:
         fcntl.flock(lock_fd, fcntl.LOCK_UN)
         os.close(lock_fd)
+
+
+def increment_counter(path):
+    path.parent.mkdir(exist_ok=True)
+    with file_lock(path.with_suffix(".lock")):
+        value = int(path.read_text()) if path.exists() else 0
+        path.write_text(str(value + 1))
+
+
+def read_counters(directory):
+    if not directory.exists():
+        return {}
+    return {path.name: int(path.read_text()) for path in sorted(directory.iterdir()) if not path.suffix}
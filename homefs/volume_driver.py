@@ -98,13 +98,17 @@ def mount_volume(name, id):
     docker_volume = DockerVolumes.query.filter_by(name=name).first()
     if not docker_volume:
         return jsonify({"Err": f"Volume {name} not found"}), 404
+    # Do not hold a database transaction open across the fetch
+    db.session.close()
 
     if not docker_volume.overlay:
         docker_volume.btrfs.activate(STORAGE_HOST)
 
     elif not docker_volume.mountpoint.exists():
-        snapshot_path = docker_volume.btrfs.fetch(STORAGE_HOST)
-        docker_volume.btrfs.overlay(docker_volume.name, snapshot_path)
+        with docker_volume.btrfs.fetch_lock():
+            if not docker_volume.mountpoint.exists():
+                snapshot_path = docker_volume.btrfs.fetch(STORAGE_HOST, locked=True)
+                docker_volume.btrfs.overlay(docker_volume.name, snapshot_path)
 
     return jsonify({"Mountpoint": str(docker_volume.mountpoint), "Err": ""})
 
@@ -1,7 +1,10 @@
+import requests
 from flask import Blueprint, Response, request
 from sqlalchemy.exc import IntegrityError
 
+from btrfs_volume import COMPRESSION_HEADER, PARENT_HEADER, PARENTS_HEADER, pipe_chunks
 from models import ActiveVolumes, db
+from volume_driver import STORAGE_HOST
 
 
 volume_server = Blueprint("volume", __name__)
@@ -19,19 +22,35 @@ def get_volume(volume):
     if request.headers.get("If-None-Match") == snapshot_path.name:
         return Response(status=304, headers={"ETag": snapshot_path.name})
 
-    stream = volume.send(snapshot_path)
-    return Response(stream, mimetype="application/octet-stream", headers={"ETag": snapshot_path.name})
+    headers = {"ETag": snapshot_path.name}
+    compression = "zstd" if request.headers.get(COMPRESSION_HEADER) == "zstd" else None
+    if compression:
+        headers[COMPRESSION_HEADER] = compression
+    parent = volume.common_parent(request.headers.get(PARENTS_HEADER, "").split(","), snapshot_path)
+    if parent:
+        headers[PARENT_HEADER] = parent
+    stream = volume.send(snapshot_path, incremental_from=parent, compression=compression)
+    return Response(stream, mimetype="application/octet-stream", headers=headers)
 
 
 @volume_server.route("/<volume:volume>", methods=["PUT"])
 def put_volume(volume):
     try:
-        volume.receive(request.stream)
+        volume.receive(pipe_chunks(request.stream), compression=request.headers.get(COMPRESSION_HEADER))
     except RuntimeError as e:
         return str(e), 400
     return "Volume successfully received\n", 201
 
 
+@volume_server.route("/<name>/host", methods=["GET"])
+def volume_host(name):
+    # Lets the scheduler place a workspace where the volume is already active; no volume is created for a lookup
+    active_volume = ActiveVolumes.query.filter_by(name=name).first()
+    if not active_volume:
+        return "Volume not active\n", 404
+    return f"{active_volume.host}\n", 200
+
+
 @volume_server.route("/<volume:volume>/activate", methods=["POST"])
 def activate_volume(volume):
     active_volume = ActiveVolumes.query.filter_by(name=volume.name).first()
@@ -51,3 +70,34 @@ def activate_volume(volume):
         return "Volume already active\n", 409
 
     return "Volume activated\n", 201
+
+
+@volume_server.route("/<volume:volume>/release", methods=["POST"])
+def release_volume(volume):
+    # Asked by the storage host when the volume moves to another node; the final snapshot stays here for it to fetch
+    volume.deactivate()
+    return "Volume released\n", 200
+
+
+@volume_server.route("/<volume:volume>/deactivate", methods=["POST"])
+def deactivate_volume(volume):
+    # Unpins the volume so that the next node to mount it can activate it: the active node snapshots and releases it,
+    # and that snapshot is fetched here before the pin is dropped, so the next activation starts from it
+    active_volume = ActiveVolumes.query.filter_by(name=volume.name).first()
+    if not active_volume:
+        return "Volume not active\n", 200
+    host = active_volume.host
+    db.session.close()
+
+    if host == STORAGE_HOST:
+        volume.deactivate()
+    else:
+        try:
+            requests.post(f"http://{host}:4201/volume/{volume.name}/release").raise_for_status()
+        except requests.exceptions.RequestException as e:
+            return f"Failed to release volume: {e}\n", 502
+        volume.fetch(host)
+
+    ActiveVolumes.query.filter_by(name=volume.name, host=host).delete()
+    db.session.commit()
+    return "Volume deactivated\n", 200
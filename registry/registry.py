@@ -0,0 +1,131 @@
+#!/usr/local/bin/python3
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import docker.errors
+import redis
+import requests
+
+from docker_clients import healthy, node_docker_client
+
+# Keeps an authoritative table of running dojo workspaces in Redis, maintained from each node's Docker events: one
+# hash per node, container id -> workspace JSON, plus a heartbeat key that readers check before trusting the hash.
+# Per-challenge counts in workspaces:counts are updated in the same scripts, which live in
+# dojo_plugin/utils/workspaces.lua and are mounted next to this file; keep the format in sync with
+# dojo_plugin/utils/workspaces.py.
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://cache:6379")
+HEARTBEAT_INTERVAL = 20
+HEARTBEAT_TIMEOUT = 60
+RESYNC_INTERVAL = 3600
+
+logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [{os.path.basename(__file__)}] [%(levelname)s] %(message)s")
+
+WORKSPACE_COUNTS_KEY = "workspaces:counts"
+
+WORKSPACES_SCRIPT = (Path(__file__).parent / "workspaces.lua").read_text()
+
+redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+workspaces_script = redis_client.register_script(WORKSPACES_SCRIPT)
+synced_nodes = set()
+
+
+def workspaces_key(node_id):
+    return f"workspaces:{node_id if node_id is not None else 'local'}"
+
+
+def workspace(attrs, node_id):
+    labels = attrs["Config"]["Labels"]
+    return dict(
+        id=attrs["Id"],
+        node=node_id,
+        user_id=int(labels["dojo.user_id"]),
+        as_user_id=int(labels.get("dojo.as_user_id", labels["dojo.user_id"])),
+        dojo=labels["dojo.dojo_id"],
+        module=labels["dojo.module_id"],
+        challenge=labels["dojo.challenge_id"],
+        mode=labels.get("dojo.mode"),
+        created=attrs["Created"],
+    )
+
+
+def sync(node_id, docker_client):
+    containers = docker_client.containers.list(filters=dict(status="running", label="dojo.dojo_id"), ignore_removed=True)
+    workspaces = {container.id: json.dumps(workspace(container.attrs, node_id)) for container in containers}
+    key = workspaces_key(node_id)
+    # Also reconciles the counts with whatever the plugin recorded for this node
+    workspaces_script(keys=[key, WORKSPACE_COUNTS_KEY], args=["sync", *(item for pair in workspaces.items() for item in pair)])
+    redis_client.set(f"{key}:synced", int(time.time()), ex=HEARTBEAT_TIMEOUT)
+    synced_nodes.add(node_id)
+    logging.info(f"Synced {len(workspaces)} workspaces on {docker_client.api.base_url}")
+
+
+def apply_event(node_id, docker_client, event):
+    key = workspaces_key(node_id)
+    container_id = event["Actor"]["ID"]
+    if event["Action"] != "start":
+        workspaces_script(keys=[key, WORKSPACE_COUNTS_KEY], args=["remove", container_id])
+        return
+    try:
+        attrs = docker_client.api.inspect_container(container_id)
+    except docker.errors.NotFound:
+        return
+    # Events are buffered from before the sync, so the container may already be gone
+    if attrs["State"]["Running"]:
+        workspaces_script(keys=[key, WORKSPACE_COUNTS_KEY], args=["add", container_id, json.dumps(workspace(attrs, node_id))])
+
+
+def follow(node_id):
+    while True:
+        try:
+            docker_client = node_docker_client(node_id)
+            # Subscribe before listing, so nothing that happens during the sync is missed
+            now = int(time.time())
+            events = docker_client.events(since=now, until=now + RESYNC_INTERVAL, decode=True,
+                                          filters=dict(type="container", event=["start", "die", "destroy"], label="dojo.dojo_id"))
+            try:
+                sync(node_id, docker_client)
+                for event in events:
+                    apply_event(node_id, docker_client, event)
+            finally:
+                events.close()
+        except (docker.errors.DockerException, requests.exceptions.RequestException, redis.RedisError) as e:
+            synced_nodes.discard(node_id)
+            logging.error(f"Lost workspaces on node {node_id}: {e}")
+            time.sleep(5)
+
+
+def heartbeat():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        try:
+            pipeline = redis_client.pipeline()
+            for node_id in list(synced_nodes):
+                # An events stream from an unreachable node can hang silently, so vouch only for nodes that answer
+                if not healthy(node_docker_client(node_id)):
+                    continue
+                pipeline.set(f"{workspaces_key(node_id)}:synced", int(time.time()), ex=HEARTBEAT_TIMEOUT)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f"Failed to refresh heartbeats: {e}")
+
+
+def main():
+    workspace_nodes = json.load(open("/var/workspace_nodes.json"))
+    node_ids = [int(node_id) for node_id in workspace_nodes] or [None]
+
+    threads = [threading.Thread(target=follow, args=(node_id,), daemon=True) for node_id in node_ids]
+    threads.append(threading.Thread(target=heartbeat, daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ import threading
 import docker
 import redis
 
+from docker_clients import node_docker_client, node_base_url
 from mac_docker import MacDockerClient
 
 
@@ -22,10 +23,24 @@ WORKSPACE_NODES = {
 
 redis_client = redis.from_url(os.environ.get("REDIS_URL"))
 
+def get_node_id(user_id):
+    if not WORKSPACE_NODES:
+        return None
+    # Recorded by the plugin's placement scheduler (dojo_plugin/utils/placement.py), keep in sync with user_node;
+    # if the cached placement was lost, find the running workspace in the registry's per-node tables
+    node_id = redis_client.get(f"flask_cache_user_{user_id}-node")
+    if node_id is None:
+        node_id = next((node_id for node_id in WORKSPACE_NODES
+                        if any(json.loads(workspace)["user_id"] == user_id
+                               for workspace in redis_client.hvals(f"workspaces:{node_id}"))), -1)
+    if int(node_id) in WORKSPACE_NODES:
+        return int(node_id)
+    return list(WORKSPACE_NODES.keys())[user_id % len(WORKSPACE_NODES)]
+
 def get_docker_client(user_id):
     image_name = redis_client.get(f"flask_cache_user_{user_id}-running-image")
-    node_id = list(WORKSPACE_NODES.keys())[user_id % len(WORKSPACE_NODES)] if WORKSPACE_NODES else None
-    docker_host = f"tcp://192.168.42.{node_id + 1}:2375" if node_id is not None else "unix:///var/run/docker.sock"
+    node_id = get_node_id(user_id)
+    docker_host = node_base_url(node_id) if node_id is not None else "unix:///var/run/docker.sock"
 
     is_mac = False
     if image_name and b"mac:" in image_name:
@@ -34,7 +49,7 @@ def get_docker_client(user_id):
                                         key_path="/home/hacker/.ssh/key")
         is_mac = True
     else:
-        docker_client = docker.DockerClient(base_url=docker_host, tls=False)
+        docker_client = node_docker_client(node_id)
     return docker_host, docker_client, is_mac
 
 def kill_exec_on_container_death(container, exec_pid):
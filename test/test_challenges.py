@@ -28,6 +28,16 @@ def test_start_challenge(admin_session, example_dojo):
     start_challenge(example_dojo, "hello", "apple", session=admin_session)
 
 
+def test_active_challenge_after_restart(random_user_session, example_dojo):
+    for challenge in ["apple", "banana"]:
+        start_challenge(example_dojo, "hello", challenge, practice=True, session=random_user_session)
+        response = random_user_session.get(f"{DOJO_URL}/pwncollege_api/v1/docker")
+        assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
+        result = response.json()
+        assert result["success"], f"Expected an active challenge right after starting it, but got {result}"
+        assert (result["module"], result["challenge"], result["practice"]) == ("hello", challenge, True), result
+
+
 def test_active_module_endpoint(random_user_session, example_dojo):
     start_challenge(example_dojo, "hello", "banana", session=random_user_session)
     response = random_user_session.get(f"{DOJO_URL}/active-module")
@@ -73,6 +83,37 @@ def test_active_module_endpoint(random_user_session, example_dojo):
     challenges["banana"]["description"] = banana_description
 
 
+def test_active_challenge_cleared(random_user_session, example_dojo):
+    start_challenge(example_dojo, "hello", "apple", session=random_user_session)
+    response = random_user_session.get(f"{DOJO_URL}/pwncollege_api/v1/docker")
+    assert response.json()["challenge"] == "apple", f"Expected active challenge 'apple', but got: {response.json()}"
+
+    response = random_user_session.delete(f"{DOJO_URL}/pwncollege_api/v1/docker")
+    assert response.json()["success"], f"Failed to terminate workspace: {response.json()}"
+
+    response = random_user_session.get(f"{DOJO_URL}/pwncollege_api/v1/docker")
+    assert not response.json()["success"], f"Expected no active challenge, but got: {response.json()}"
+
+
+def hacking_count(dojo, module, challenge_name, *, session):
+    response = session.get(f"{DOJO_URL}/{dojo}/{module}/")
+    assert response.status_code == 200
+    header = re.search(rf">\s*{challenge_name}\s*</span>.*?challenge-header-right\">(.*?)total-solves", response.text, re.DOTALL)
+    assert header, f"Challenge {challenge_name} not found on the module page"
+    count = re.search(r"(\d+) hacking", header.group(1))
+    return int(count.group(1)) if count else 0
+
+
+def test_hacking_counts(random_user_session, example_dojo):
+    before = hacking_count(example_dojo, "hello", "Banana", session=random_user_session)
+    start_challenge(example_dojo, "hello", "banana", session=random_user_session)
+    assert hacking_count(example_dojo, "hello", "Banana", session=random_user_session) == before + 1
+
+    response = random_user_session.delete(f"{DOJO_URL}/pwncollege_api/v1/docker")
+    assert response.json()["success"], f"Failed to terminate workspace: {response.json()}"
+    assert hacking_count(example_dojo, "hello", "Banana", session=random_user_session) == before
+
+
 def test_progression_locked(progression_locked_dojo, random_user_name, random_user_session):
     assert random_user_session.get(f"{DOJO_URL}/dojo/{progression_locked_dojo}/join/").status_code == 200
     start_challenge(progression_locked_dojo, "progression-locked-module", "unlocked-challenge", session=random_user_session)
@@ -101,6 +142,11 @@ def test_workspace_flag_permission():
         assert False, f"Expected permission denied, but got no error: {(e.stdout, e.stderr)}"
 
 
+def test_workspace_challenge_permissions():
+    result = workspace_run("stat -c '%U:%G %a' /challenge/apple", user="admin")
+    assert result.stdout.strip() == "root:root 4755", f"Expected setuid root challenge, but got: {result.stdout}"
+
+
 def test_workspace_challenge():
     result = workspace_run("/challenge/apple", user="admin")
     match = re.search("pwn.college{(\\S+)}", result.stdout)
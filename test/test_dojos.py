@@ -191,3 +191,19 @@ def test_dojo_solves_api(example_dojo, random_user_name, random_user_session):
     assert data["success"]
     assert len(data["solves"]) == 1
     assert data["solves"][0]["challenge_id"] == "apple"
+
+
+def test_dojo_daily_stats(example_dojo, random_user_name, random_user_session):
+    def daily_stats():
+        result = db_sql(f"""
+            SELECT coalesce(sum(solves), 0), coalesce(sum(users), 0) FROM dojo_daily_stats JOIN dojos USING (dojo_id)
+            WHERE dojos.id = '{example_dojo}' AND day = (now() AT TIME ZONE 'UTC')::date
+        """)
+        return tuple(int(value) for value in result.strip().split("|"))
+
+    solves, users = daily_stats()
+    start_challenge(example_dojo, "hello", "apple", session=random_user_session)
+    solve_challenge(example_dojo, "hello", "apple", session=random_user_session, user=random_user_name)
+    start_challenge(example_dojo, "hello", "banana", session=random_user_session)
+    solve_challenge(example_dojo, "hello", "banana", session=random_user_session, user=random_user_name)
+    assert daily_stats() == (solves + 2, users + 1), f"Expected two more solves by one more user, but got: {daily_stats()}"
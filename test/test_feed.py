@@ -1,7 +1,7 @@
 import time
 import logging
 import requests
-from utils import DOJO_URL, start_challenge, solve_challenge
+from utils import DOJO_URL, start_challenge, solve_challenge, get_user_id
 from selenium.webdriver import Firefox, FirefoxOptions
 from selenium.webdriver.common.by import By
 
@@ -135,3 +135,43 @@ def test_private_dojo_events_not_shown(random_private_dojo, random_user_name, ra
 
     assert not found_event, "Private dojo events should NOT appear in the feed!"
     assert len(events_after) == initial_count, f"Event count changed! Before: {initial_count}, After: {len(events_after)}"
+
+
+def test_feed_cursor_pagination(example_dojo, random_user_session):
+    for challenge in ["apple", "banana", "apple"]:
+        start_challenge(example_dojo, "hello", challenge, session=random_user_session)
+
+    response = requests.get(f"{DOJO_URL}/pwncollege_api/v1/feed/events", params={"limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page["data"]) == 2 and first_page["meta"]["next_cursor"], f"Expected a full first page: {first_page}"
+
+    response = requests.get(f"{DOJO_URL}/pwncollege_api/v1/feed/events", params={"limit": 2, "before": first_page["meta"]["next_cursor"]})
+    assert response.status_code == 200
+    second_page = response.json()
+    assert second_page["data"], f"Expected a second page: {second_page}"
+
+    first_ids = {event["id"] for event in first_page["data"]}
+    assert not first_ids & {event["id"] for event in second_page["data"]}, "Pages should not overlap"
+    assert min(event["timestamp"] for event in first_page["data"]) >= max(event["timestamp"] for event in second_page["data"])
+
+
+def test_feed_invalid_cursor():
+    for before in ["nan", "inf", "-inf", "apple"]:
+        response = requests.get(f"{DOJO_URL}/pwncollege_api/v1/feed/events", params={"before": before})
+        assert response.status_code == 400, f"Expected cursor {before!r} to be rejected, but got {response.status_code}"
+
+
+def test_feed_filters(example_dojo, random_user_name, random_user_session):
+    start_challenge(example_dojo, "hello", "apple", session=random_user_session)
+    user_id = get_user_id(random_user_name)
+
+    response = requests.get(f"{DOJO_URL}/pwncollege_api/v1/feed/events", params={"dojo": example_dojo})
+    assert response.status_code == 200
+    events = response.json()["data"]
+    assert events and all(event["data"]["dojo_id"] == example_dojo for event in events), f"Expected only {example_dojo} events: {events}"
+
+    response = requests.get(f"{DOJO_URL}/pwncollege_api/v1/feed/events", params={"user": user_id})
+    assert response.status_code == 200
+    events = response.json()["data"]
+    assert events and all(event["user_id"] == user_id for event in events), f"Expected only events by {random_user_name}: {events}"
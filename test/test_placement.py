@@ -0,0 +1,93 @@
+import json
+import subprocess
+import shutil
+
+import pytest
+
+from utils import DOJO_URL, DOJO_CONTAINER, start_challenge, get_user_id, dojo_run, db_sql
+
+
+RANK_NODES_CHECKS = """
+from CTFd.plugins.dojo_plugin.utils.placement import choose_node, rank_nodes
+
+nodes = [1, 2, 3]
+idle = dict(counts={}, pressure={}, cached=set())
+
+# Without load data, placement is stable per user and spreads users over every node
+assert all(rank_nodes(user_id, nodes, **idle) == rank_nodes(user_id, nodes, **idle) for user_id in range(100))
+assert {rank_nodes(user_id, nodes, **idle)[0] for user_id in range(100)} == set(nodes)
+
+# Removing a node only moves the users who were placed on it
+for user_id in range(100):
+    first = rank_nodes(user_id, nodes, **idle)[0]
+    remaining = [node_id for node_id in nodes if node_id != 3]
+    assert first == 3 or rank_nodes(user_id, remaining, **idle)[0] == first
+
+# Fewer workspaces wins, then the image, and heavy pressure outweighs the image
+assert rank_nodes(0, nodes, counts={1: 10, 2: 4, 3: 10}, pressure={}, cached=set())[0] == 2
+assert rank_nodes(0, nodes, counts={1: 5, 2: 5, 3: 5}, pressure={}, cached={3})[0] == 3
+assert rank_nodes(0, nodes, counts={1: 5, 2: 5, 3: 5}, pressure={3: 0.5}, cached={3})[0] != 3
+
+# A user stays on the node holding their home volume unless it is overloaded by the migration margin
+assert choose_node(0, nodes, 1, counts={1: 6, 2: 4, 3: 5}, pressure={}, cached=set()) == 1
+assert choose_node(0, nodes, 1, counts={1: 10, 2: 2, 3: 3}, pressure={}, cached=set()) == 2
+assert choose_node(0, nodes, 1, counts={1: 5, 2: 5, 3: 5}, pressure={1: 0.6}, cached=set()) != 1
+assert choose_node(0, nodes, None, counts={1: 6, 2: 4, 3: 5}, pressure={}, cached=set()) == 2
+print("ok")
+"""
+
+
+def ctfd_python(script):
+    return dojo_run("docker", "exec", "-i", "-w", "/opt/CTFd", "ctfd", "python", "-", input=script, check=False)
+
+
+def workspace_nodes():
+    try:
+        return json.loads(dojo_run("cat", "/data/workspace_nodes.json").stdout)
+    except (subprocess.CalledProcessError, json.JSONDecodeError):
+        return {}
+
+
+def container_node(container_name, node_ids):
+    for node_id in node_ids:
+        result = subprocess.run(
+            [shutil.which("docker"), "exec", "-i", f"{DOJO_CONTAINER}-node{node_id}", "docker", "ps", "--format", "{{.Names}}"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+        )
+        if container_name in result.stdout.split():
+            return int(node_id)
+    return None
+
+
+def test_rank_nodes():
+    result = ctfd_python(RANK_NODES_CHECKS)
+    assert result.returncode == 0 and result.stdout.strip() == "ok", result.stderr
+
+
+def test_placement_follows_home_volume(random_user_name, random_user_session, example_dojo):
+    nodes = workspace_nodes()
+    if not nodes:
+        pytest.skip("No worker nodes configured - skipping placement test")
+
+    user_id = get_user_id(random_user_name)
+    for challenge in ["apple", "banana"]:
+        start_challenge(example_dojo, "hello", challenge, session=random_user_session)
+        node_id = int(db_sql(f"SELECT node_id FROM workspace_placements WHERE user_id = {user_id}"))
+        assert container_node(f"user_{user_id}", nodes) == node_id, f"Expected the workspace on node {node_id}"
+
+        host = dojo_run("curl", "-s", f"http://localhost:4201/volume/{user_id}/host").stdout.strip()
+        assert host == f"192.168.42.{node_id + 1}", f"Expected the home volume to be pinned to node {node_id}, got {host!r}"
+
+
+def test_placement_survives_cache_loss(random_user_name, random_user_session, example_dojo):
+    nodes = workspace_nodes()
+    if not nodes:
+        pytest.skip("No worker nodes configured - skipping placement test")
+
+    start_challenge(example_dojo, "hello", "apple", session=random_user_session)
+    user_id = get_user_id(random_user_name)
+    dojo_run("docker", "exec", "cache", "redis-cli", "DEL", f"flask_cache_user_{user_id}-node")
+
+    response = random_user_session.get(f"{DOJO_URL}/pwncollege_api/v1/docker")
+    assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
+    assert response.json()["success"], f"Expected to find the workspace after losing the cached placement: {response.json()}"
@@ -1,9 +1,9 @@
 import pytest
 
-from utils import DOJO_URL, workspace_run, start_challenge, solve_challenge
+from utils import DOJO_URL, workspace_run, start_challenge, solve_challenge, dojo_run, db_sql, get_user_id
 
 
-def get_all_standings(session, dojo, module=None):
+def get_all_standings(session, dojo, module=None, duration=0):
     """
     Return a big list of all the standings, going through all the available pages.
     """
@@ -16,7 +16,7 @@ def get_all_standings(session, dojo, module=None):
         module = "_"
 
     while not done:
-        response = session.get(f"{DOJO_URL}/pwncollege_api/v1/scoreboard/{dojo}/{module}/0/{page_number}")
+        response = session.get(f"{DOJO_URL}/pwncollege_api/v1/scoreboard/{dojo}/{module}/{duration}/{page_number}")
         assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
         response = response.json()
 
@@ -32,19 +32,20 @@ def get_all_standings(session, dojo, module=None):
     return to_return
 
 
-def test_scoreboard(random_user_name, random_user_session, example_dojo):
+@pytest.mark.parametrize("duration", [0, 7, 30])
+def test_scoreboard(random_user_name, random_user_session, example_dojo, duration):
     dojo = example_dojo
     module = "hello"
     challenge = "apple"
 
-    prior_standings = get_all_standings(random_user_session, dojo, module)
+    prior_standings = get_all_standings(random_user_session, dojo, module, duration)
 
     start_challenge(dojo, module, challenge, session=random_user_session)
     result = workspace_run("/challenge/apple", user=random_user_name)
     flag = result.stdout.strip()
     solve_challenge(dojo, module, challenge, session=random_user_session, flag=flag)
 
-    new_standings = get_all_standings(random_user_session, dojo, module)
+    new_standings = get_all_standings(random_user_session, dojo, module, duration)
     assert len(prior_standings) != len(new_standings), "Expected to have a new entry in the standings"
 
     found_me = False
@@ -53,3 +54,23 @@ def test_scoreboard(random_user_name, random_user_session, example_dojo):
             found_me = True
             break
     assert found_me, f"Unable to find new user {random_user_name} in new standings after solving a challenge"
+
+
+@pytest.mark.parametrize("duration", [7, 30])
+def test_scoreboard_window_boundary(random_user_name, random_user_session, example_dojo, duration):
+    dojo = example_dojo
+    module = "hello"
+    challenge = "apple"
+
+    start_challenge(dojo, module, challenge, session=random_user_session)
+    result = workspace_run("/challenge/apple", user=random_user_name)
+    solve_challenge(dojo, module, challenge, session=random_user_session, flag=result.stdout.strip())
+    user_id = get_user_id(random_user_name)
+
+    def standing_names(days_ago):
+        db_sql(f"UPDATE submissions SET date = current_date - {days_ago} + interval '12 hours' WHERE user_id = {user_id} AND type = 'correct'")
+        dojo_run("docker", "exec", "cache", "redis-cli", "INCR", "scoreboard:generation")
+        return {standing["name"] for standing in get_all_standings(random_user_session, dojo, module, duration)}
+
+    assert random_user_name in standing_names(duration - 1), f"Expected a solve {duration - 1} days ago to be on the {duration} day scoreboard"
+    assert random_user_name not in standing_names(duration), f"Expected a solve {duration} days ago to be off the {duration} day scoreboard"
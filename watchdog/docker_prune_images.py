@@ -5,24 +5,24 @@ import logging
 import os
 from concurrent.futures import ThreadPoolExecutor
 
-import docker
+from docker_clients import node_docker_client
 
 logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [{os.path.basename(__file__)}] [%(levelname)s] %(message)s")
 
 logging.info("Starting")
 
 workspace_nodes = json.load(open("/var/workspace_nodes.json"))
-workspace_node_ips = [f"192.168.42.{int(node_id) + 1}" for node_id in workspace_nodes]
+workspace_node_ids = [int(node_id) for node_id in workspace_nodes]
 
-def prune_images(docker_client_ip):
-    docker_client = docker.DockerClient(base_url=f"tcp://{docker_client_ip}:2375", timeout=3600)
+def prune_images(node_id):
+    docker_client = node_docker_client(node_id, timeout=3600)
     logging.info(f"Pruning docker images on {docker_client.api.base_url}")
     docker_client.images.prune()
     logging.info(f"Prune docker images complete on {docker_client.api.base_url}")
 
 with ThreadPoolExecutor() as executor:
     logging.info("Pruning images")
-    list(executor.map(prune_images, workspace_node_ips))
+    list(executor.map(prune_images, workspace_node_ids))
     logging.info("Pruned images")
 
 logging.info("Finished")
@@ -7,7 +7,7 @@ import re
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
-import docker
+from docker_clients import node_docker_client
 
 OLD_CONTAINER_AGE = timedelta(hours=6)
 
@@ -19,7 +19,7 @@ logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [{os.path.basename(
 logging.info("Starting")
 
 workspace_nodes = json.load(open("/var/workspace_nodes.json"))
-workspace_node_ips = [f"192.168.42.{int(node_id) + 1}" for node_id in workspace_nodes]
+workspace_node_ids = [int(node_id) for node_id in workspace_nodes]
 
 now = datetime.now(timezone.utc)
 
@@ -30,8 +30,8 @@ def human_size(n):
         n /= 1024.0
     return f"{n:.1f}PiB"
 
-def remove_old_containers(docker_client_ip):
-    docker_client = docker.DockerClient(base_url=f"tcp://{docker_client_ip}:2375")
+def remove_old_containers(node_id):
+    docker_client = node_docker_client(node_id)
 
     logging.info(f"Removing docker containers on {docker_client.api.base_url}")
 
@@ -59,7 +59,7 @@ def remove_old_containers(docker_client_ip):
 
 with ThreadPoolExecutor() as executor:
     logging.info("Removing docker containers")
-    list(executor.map(remove_old_containers, workspace_node_ips))
+    list(executor.map(remove_old_containers, workspace_node_ids))
     logging.info("Removed docker containers")
 
 logging.info("Finished")